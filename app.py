@@ -1,26 +1,105 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
 from logic.actions import executar_acao
-from logic.integrations import configure_google_sheets
+from logic.integrations import (
+    configure_google_sheets,
+    save_slot_snapshot,
+    sheets_ready,
+    start_sheets_warmup,
+    stop_write_behind,
+    warmup_status,
+)
+from logic.messaging import UltraMsgClient, ULTRAMSG_BASE_URL
+from logic.outbox import OutboundQueue
+from logic.backends import SqliteDedupCache, use_sqlite_backend
+from logic.slots import parse_capacities
+from logic.dedup import DedupCache
+from logic.dispatcher import UserDispatcher
+from logic import metrics
 from dotenv import load_dotenv
 import os
-import requests
 
 load_dotenv()
 
 ULTRAMSG_INSTANCE_ID = os.getenv("ULTRAMSG_INSTANCE_ID")
 ULTRAMSG_TOKEN = os.getenv("ULTRAMSG_TOKEN")
+ULTRAMSG_BASE = os.getenv("ULTRAMSG_BASE_URL", ULTRAMSG_BASE_URL)
+# Envios por segundo (e rajada) permitidos pelo plano do UltraMsg. O limite é
+# da instância: cada worker do uvicorn (WEB_CONCURRENCY) fica com uma parte.
+ULTRAMSG_RATE = float(os.getenv("ULTRAMSG_RATE", "5"))
+ULTRAMSG_BURST = int(os.getenv("ULTRAMSG_BURST", "10"))
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+# Respostas que não puderam ser entregues; reenviadas no próximo boot.
+ULTRAMSG_DEAD_LETTER_PATH = os.getenv("ULTRAMSG_DEAD_LETTER_PATH", "ultramsg.deadletter")
 
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID")
 CREDENTIALS_PATH = os.getenv("CREDENTIALS_PATH")
 
+# Aulas simultâneas por recurso, ex.: RESOURCE_CAPACITIES="instrutor=3,sala=20".
+# Sem configurar, um horário aceita uma aula só.
+RESOURCE_CAPACITIES = parse_capacities(os.getenv("RESOURCE_CAPACITIES"))
+
+# Com vários workers do uvicorn, aponte para um arquivo SQLite compartilhado.
+STATE_DB_PATH = os.getenv("STATE_DB_PATH")
+shared_state = use_sqlite_backend(STATE_DB_PATH, resource_capacities=RESOURCE_CAPACITIES) if STATE_DB_PATH else {}
+
 configure_google_sheets(
     credentials_json_path=CREDENTIALS_PATH,
     sheet_id=GOOGLE_SHEET_ID,
     worksheet_name="Agendamentos",
     use_cache=True,
+    background=True,
+    resource_capacities=RESOURCE_CAPACITIES,
+    **shared_state,
+)
+
+# Ex: PROFILE_SAMPLE_RATE=0.01 perfila 1% das mensagens; o resultado vai para
+# PROFILE_OUTPUT ao desligar (`python -m pstats bot.prof`).
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT", "bot.prof")
+metrics.configure_profiling(PROFILE_SAMPLE_RATE)
+
+# O UltraMsg reenvia o webhook quando demoramos a responder. Com vários
+# workers a reentrega pode cair em outro processo: os ids ficam no SQLite.
+if STATE_DB_PATH:
+    processed_messages = SqliteDedupCache(STATE_DB_PATH, ttl=600, max_size=50000)
+else:
+    processed_messages = DedupCache(ttl=600, max_size=50000)
+
+def processar_mensagem(message: str, user_id: str) -> str:
+    with metrics.sampled_profile():
+        return executar_acao(message, user_id)
+
+
+# Mensagens do mesmo usuário em ordem; usuários diferentes em paralelo.
+dispatcher = UserDispatcher(processar_mensagem, max_concurrency=32, max_workers=8)
+
+ultramsg = UltraMsgClient(ULTRAMSG_INSTANCE_ID, ULTRAMSG_TOKEN, base_url=ULTRAMSG_BASE)
+outbox = OutboundQueue(
+    ultramsg,
+    rate=ULTRAMSG_RATE / WEB_CONCURRENCY,
+    burst=max(1, ULTRAMSG_BURST // WEB_CONCURRENCY),
+    dead_letter_path=ULTRAMSG_DEAD_LETTER_PATH,
 )
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Autenticação e carga da planilha rodam em segundo plano; o servidor já
+    # responde enquanto isso (ver /ready).
+    start_sheets_warmup()
+    outbox.start_replay()
+    yield
+    dispatcher.shutdown()
+    await outbox.close()
+    await ultramsg.aclose()
+    stop_write_behind()
+    save_slot_snapshot()
+    metrics.dump_profile(PROFILE_OUTPUT)
+
+
+app = FastAPI(lifespan=lifespan)
 
 @app.post("/webhook/whatsapp")
 async def whatsapp_webhook(request: Request):
@@ -33,22 +112,37 @@ async def whatsapp_webhook(request: Request):
     if not incoming_message or not user_id:
         return Response(content="success", media_type="application/json")
 
+    message_id = inner.get("id")
+    if message_id:
+        is_new, _ = processed_messages.begin(message_id)
+        if not is_new:
+            return Response(content="success", media_type="application/json")
+
     try:
-        response_text = executar_acao(incoming_message, user_id)
+        with metrics.timed("webhook"):
+            response_text = await dispatcher.submit(user_id, incoming_message)
     except Exception:
         response_text = "Erro interno."
 
-    url = f"https://api.ultramsg.com/{ULTRAMSG_INSTANCE_ID}/messages/chat"
-    payload = {
-        "token": ULTRAMSG_TOKEN,
-        "to": user_id,
-        "body": response_text
-    }
+    if message_id:
+        processed_messages.complete(message_id, response_text)
 
-    requests.post(url, data=payload)
+    # None = mensagem repetida agrupada com a anterior, que já foi respondida.
+    # Com a fila de saída cheia, esperar aqui segura o UltraMsg (backpressure).
+    if response_text is not None:
+        await outbox.send(user_id, response_text)
 
     return Response(content="success", media_type="application/json")
 
 @app.get("/")
 def home():
     return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    status = warmup_status()
+    return JSONResponse(status, status_code=200 if sheets_ready() else 503)
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,112 +1,144 @@
-from typing import Dict, Any
-from logic.state_manager import set_state, clear_state, get_state
+from typing import Callable, Dict, NamedTuple, Optional
+from logic.state_manager import SessionState, set_state, clear_state, get_state
 from logic.nlu import recognize_intent
-from logic.integrations import calendar_api_check_availability, calendar_api_book_slot
-
-def get_saudacao(user_id):
-    state = {"fluxo": "menu", "etapa": "aguardando_opcao", "tipo_aula": None}
-    set_state(user_id, state)
-    return (
-        "Olá! Eu sou seu assistente virtual da autoescola Brasília\n"
-        "Como posso te ajudar hoje?\n\n"
-        "1️⃣ - Marcar aula prática\n"
-        "2️⃣ - Marcar aula teórica\n"
-        "3️⃣ - Fazer simulado teórico (link do Detran)\n"
-        "4️⃣ - Falar com um atendente humano\n"
-        "5️⃣ - Finalizar atendimento"
-    )
-
-def get_fallback(user_id):
-    return (
-        "Desculpe, não entendi o que você quis dizer 😅\n"
-        "Mas posso te ajudar com as seguintes opções:\n\n"
-        "1️⃣ - Marcar aula prática\n"
-        "2️⃣ - Marcar aula teórica\n"
-        "3️⃣ - Fazer simulado teórico (link do Detran)\n"
-        "4️⃣ - Falar com um atendente humano\n"
-        "5️⃣ - Finalizar atendimento"
-    )
-
-def falar_com_atendente(user_id):
-    clear_state(user_id)
-    return "Certo, entre em contato com nosso atendente pelo telefone: (44) 99999-9999."
-
-def finalizar_atendimento(user_id):
-    clear_state(user_id)
-    return "Tudo bem! Atendimento finalizado."
-
-def get_link_simulado(user_id):
-    clear_state(user_id)
-    return "Aqui está o link para o simulado: https://www.detran.sp.gov.br/simulado"
-
-def iniciar_agendamento(user_id: str, tipo_aula: str):
-    state = {"fluxo": "agendamento", "etapa": "aguardando_nome", "tipo_aula": tipo_aula}
-    set_state(user_id, state)
-    return f"Perfeito! Vamos marcar sua aula {tipo_aula}. Qual seu nome completo?"
-
-def processar_nome_agendamento(user_id: str, nome_completo: str):
-    state = get_state(user_id)
-    state["nome"] = nome_completo.strip()
-    state["etapa"] = "aguardando_data"
-    set_state(user_id, state)
-    primeiro_nome = nome_completo.strip().split()[0]
-    return f"Ótimo, {primeiro_nome}! Qual data e horário (ex: YYYY-MM-DDTHH:MM) você gostaria de agendar?"
-
-def processar_data_agendamento(user_id: str, data_hora: str):
-    state = get_state(user_id)
-    slot = data_hora.strip()
-
-    if calendar_api_check_availability(slot):
-        result = calendar_api_book_slot({
-            "nome": state.get("nome"),
-            "tipo": state.get("tipo_aula"),
-            "slot": slot,
-            "user_id": user_id
-        })
-
-        if result["status"] == "booked":
-            clear_state(user_id)
-            return f"Aula agendada com sucesso para {slot}!"
-
-        elif result["status"] == "conflict":
-            return f"O horário {slot} não está disponível. Tente outro."
-
-        else:
-            return "Ocorreu um erro ao tentar agendar."
-
-    else:
-        return f"O horário {slot} não está disponível. Tente outro."
+from logic.integrations import calendar_api_book_slot, calendar_api_next_free_slots
+from logic.slots import parse_slot
+from logic.metrics import timed
+
+# Respostas montadas uma vez no import; as personalizadas são `str.format`
+# de moldes fixos.
+_MENU = (
+    "1️⃣ - Marcar aula prática\n"
+    "2️⃣ - Marcar aula teórica\n"
+    "3️⃣ - Fazer simulado teórico (link do Detran)\n"
+    "4️⃣ - Falar com um atendente humano\n"
+    "5️⃣ - Finalizar atendimento"
+)
+SAUDACAO = (
+    "Olá! Eu sou seu assistente virtual da autoescola Brasília\n"
+    "Como posso te ajudar hoje?\n\n" + _MENU
+)
+FALLBACK = (
+    "Desculpe, não entendi o que você quis dizer 😅\n"
+    "Mas posso te ajudar com as seguintes opções:\n\n" + _MENU
+)
+ATENDENTE = "Certo, entre em contato com nosso atendente pelo telefone: (44) 99999-9999."
+FINALIZADO = "Tudo bem! Atendimento finalizado."
+LINK_SIMULADO = "Aqui está o link para o simulado: https://www.detran.sp.gov.br/simulado"
+DATA_INVALIDA = "Não entendi a data. Envie no formato YYYY-MM-DDTHH:MM (ex: 2025-03-01T10:00)."
+AGENDA_CARREGANDO = "Nossa agenda ainda está carregando. Envie o horário de novo em alguns segundos, por favor."
+ERRO_AGENDAMENTO = "Ocorreu um erro ao tentar agendar."
+
+_pedir_nome = "Perfeito! Vamos marcar sua aula {}. Qual seu nome completo?".format
+_pedir_data = "Ótimo, {}! Qual data e horário (ex: YYYY-MM-DDTHH:MM) você gostaria de agendar?".format
+_agendada = "Aula agendada com sucesso para {}!".format
+_horario_invalido = "O horário {} não pode ser agendado ({}). Tente outro.".format
+_indisponivel = "O horário {} não está disponível. Tente outro.".format
+_sugestoes = (
+    "O horário {} não está disponível. Horários livres mais próximos:\n"
+    "{}\n"
+    "Responda com um deles ou envie outro horário."
+).format
+
+# Estados fixos da conversa, montados uma vez; `set_state` grava uma cópia,
+# então alterar a sessão de um usuário não mexe nestes.
+_AGUARDANDO_OPCAO = SessionState(etapa="aguardando_opcao")
+_AGUARDANDO_NOME = {
+    tipo: SessionState(fluxo="agendamento", etapa="aguardando_nome", tipo_aula=tipo)
+    for tipo in ("prática", "teórica")
+}
+_PEDIR_NOME = {tipo: _pedir_nome(tipo) for tipo in _AGUARDANDO_NOME}
+
+# Próximo estado de uma ação: um estado fixo, _ENCERRA (apaga a sessão) ou
+# _MANTEM (não mexe nela).
+_ENCERRA = object()
+_MANTEM = object()
+
+
+class Acao(NamedTuple):
+    resposta: Optional[str] = None
+    proximo: object = _MANTEM
+    # Ações que dependem da mensagem ou de serviços externos.
+    handler: Optional[Callable[[str, SessionState, str], str]] = None
+
+
+def processar_nome_agendamento(user_id: str, nome_completo: str, state: Optional[SessionState] = None):
+    if state is None:
+        state = get_state(user_id)
+    nome = nome_completo.strip()
+    # Estado novo, de ninguém mais: grava sem copiar.
+    set_state(user_id, SessionState(fluxo="agendamento", etapa="aguardando_data", tipo_aula=state.tipo_aula, nome=nome), copy=False)
+    return _pedir_data(nome.split()[0])
+
+def _sugerir_horarios(slot: str, tipo_aula: str) -> str:
+    livres = calendar_api_next_free_slots(slot, count=3, tipo=tipo_aula)
+    if not livres:
+        return _indisponivel(slot)
+    return _sugestoes(slot, "\n".join(["- " + h for h in livres]))
+
+def processar_data_agendamento(user_id: str, data_hora: str, state: Optional[SessionState] = None):
+    if state is None:
+        state = get_state(user_id)
+    tipo_aula = state.tipo_aula
+
+    if parse_slot(data_hora) is None:
+        return DATA_INVALIDA
+
+    result = calendar_api_book_slot({
+        "nome": state.nome,
+        "tipo": tipo_aula,
+        "slot": data_hora.strip(),
+        "user_id": user_id
+    })
+    status = result["status"]
+    slot = result["slot"]
+
+    if status == "booked":
+        clear_state(user_id)
+        return _agendada(slot)
+    if status == "conflict":
+        return _sugerir_horarios(slot, tipo_aula)
+    if status == "invalid":
+        return _horario_invalido(slot, result["reason"])
+    if status == "unavailable":
+        return AGENDA_CARREGANDO
+    return ERRO_AGENDAMENTO
+
+
+def _nome(user_id: str, state: SessionState, texto: str) -> str:
+    return processar_nome_agendamento(user_id, texto, state)
+
+def _data(user_id: str, state: SessionState, texto: str) -> str:
+    return processar_data_agendamento(user_id, texto, state)
+
+
+# Máquina de estados da conversa: intenção -> (resposta, próximo estado) ou
+# handler. Um fluxo novo é uma entrada a mais aqui (e a intenção em logic/nlu.py).
+ACOES: Dict[str, Acao] = {
+    "saudacao": Acao(SAUDACAO, _AGUARDANDO_OPCAO),
+    "marcar_aula_pratica": Acao(_PEDIR_NOME["prática"], _AGUARDANDO_NOME["prática"]),
+    "marcar_aula_teorica": Acao(_PEDIR_NOME["teórica"], _AGUARDANDO_NOME["teórica"]),
+    "link_simulado": Acao(LINK_SIMULADO, _ENCERRA),
+    "falar_com_atendente": Acao(ATENDENTE, _ENCERRA),
+    "finalizar_atendimento": Acao(FINALIZADO, _ENCERRA),
+    "processar_nome_agendamento": Acao(handler=_nome),
+    "processar_data_agendamento": Acao(handler=_data),
+    "fallback": Acao(FALLBACK),
+}
+_FALLBACK = ACOES["fallback"]
+
 
 def executar_acao(message: str, user_id: str) -> str:
-    state = get_state(user_id)
+    with timed("state_lookup"):
+        state = get_state(user_id)
 
     intent, extra_data = recognize_intent(message, state)
-
-    if intent == "marcar_aula_pratica":
-        return iniciar_agendamento(user_id, "prática")
-
-    elif intent == "marcar_aula_teorica":
-        return iniciar_agendamento(user_id, "teórica")
-
-    elif intent == "link_simulado":
-        return get_link_simulado(user_id)
-
-    elif intent == "falar_com_atendente":
-        return falar_com_atendente(user_id)
-
-    elif intent == "finalizar_atendimento":
-        return finalizar_atendimento(user_id)
-
-    elif intent == "saudacao":
-        return get_saudacao(user_id)
-
-    elif intent == "processar_nome_agendamento":
-        return processar_nome_agendamento(user_id, extra_data)
-
-    elif intent == "processar_data_agendamento":
-        return processar_data_agendamento(user_id, extra_data)
-
-    elif intent == "fallback":
-        return get_fallback(user_id)
-
-    return get_fallback(user_id)
+    acao = ACOES.get(intent, _FALLBACK)
+
+    if acao.handler is not None:
+        return acao.handler(user_id, state, extra_data)
+    if acao.proximo is _ENCERRA:
+        clear_state(user_id)
+    elif acao.proximo is not _MANTEM:
+        set_state(user_id, acao.proximo)
+    return acao.resposta
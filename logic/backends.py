@@ -0,0 +1,414 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from logic.dedup import WEBHOOK_DUPLICATES
+from logic.slots import (
+    DEFAULT_RESOURCE,
+    RESOURCE_CAPACITIES,
+    format_slot,
+    format_unit,
+    from_minutes,
+    parse_unit,
+    to_minutes,
+)
+from logic.state_manager import SessionState
+
+_MINUTE = timedelta(minutes=1)
+
+
+class _SqliteBase:
+    # Uma conexão por thread; o modo WAL deixa vários processos lerem enquanto
+    # um escreve, e o busy_timeout faz os escritores esperarem a vez.
+    def __init__(self, path: str, timeout: float = 10.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._init_schema(self._conn())
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self, conn: sqlite3.Connection) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class SqliteBookingIndex(_SqliteBase):
+    """Índice de aulas compartilhado entre processos (um arquivo SQLite por host).
+
+    Mesma interface do SlotIndex: uma raia por unidade de cada recurso e
+    recusa rápida pela contagem de aulas no horário. Verificar e reservar
+    acontece dentro de uma transação IMMEDIATE, portanto é atômico entre
+    todos os workers.
+
+    Como no SlotIndex, recarregar uma aula que já está na tabela (cada worker
+    lê a planilha inteira no boot) não ocupa outra unidade: ela é reconhecida
+    pela unidade e horário ou pela `source` das linhas antigas.
+    """
+
+    def __init__(self, path: str, capacities: Optional[Dict[str, int]] = None, timeout: float = 10.0):
+        self.capacities = dict(capacities or RESOURCE_CAPACITIES)
+        super().__init__(path, timeout)
+
+    def _init_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS lessons ("
+            " resource TEXT NOT NULL, lane INTEGER NOT NULL,"
+            " start_min INTEGER NOT NULL, end_min INTEGER NOT NULL, source TEXT,"
+            " PRIMARY KEY (resource, lane, start_min))"
+        )
+        if "source" not in [r[1] for r in conn.execute("PRAGMA table_info(lessons)")]:
+            conn.execute("ALTER TABLE lessons ADD COLUMN source TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS lessons_start ON lessons (start_min, resource)")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS lessons_source ON lessons (source) WHERE source IS NOT NULL")
+
+    def capacity(self, resource: str) -> int:
+        return self.capacities.get(resource, 1)
+
+    @staticmethod
+    def _lane_conflicts(conn: sqlite3.Connection, resource: str, lane: int, start: int, end: int) -> bool:
+        # Dentro de uma raia as aulas não se sobrepõem, então só a última que
+        # começa antes do fim da nova pode colidir com ela.
+        row = conn.execute(
+            "SELECT end_min FROM lessons WHERE resource = ? AND lane = ? AND start_min < ?"
+            " ORDER BY start_min DESC LIMIT 1",
+            (resource, lane, end),
+        ).fetchone()
+        return row is not None and row[0] > start
+
+    def _free_lanes(self, conn: sqlite3.Connection, resource: str, start: int, end: int) -> List[int]:
+        capacity = self.capacity(resource)
+        booked = conn.execute(
+            "SELECT COUNT(*) FROM lessons WHERE resource = ? AND start_min = ?", (resource, start)
+        ).fetchone()[0]
+        if booked >= capacity:
+            return []
+        return [lane for lane in range(capacity) if not self._lane_conflicts(conn, resource, lane, start, end)]
+
+    def remaining(self, start: datetime, duration: timedelta, resource: str = DEFAULT_RESOURCE) -> int:
+        s = to_minutes(start)
+        return len(self._free_lanes(self._conn(), resource, s, s + duration // _MINUTE))
+
+    def is_free(self, start: datetime, duration: timedelta, resource: str = DEFAULT_RESOURCE) -> bool:
+        return self.remaining(start, duration, resource) > 0
+
+    @staticmethod
+    def _present(conn: sqlite3.Connection, s: int, e: int, resource: str, lane: Optional[int], source: Optional[str]) -> bool:
+        if source is not None:
+            return conn.execute("SELECT 1 FROM lessons WHERE source = ?", (source,)).fetchone() is not None
+        if lane is None:
+            return False
+        return conn.execute(
+            "SELECT 1 FROM lessons WHERE resource = ? AND lane = ? AND start_min = ? AND end_min = ?",
+            (resource, lane, s, e),
+        ).fetchone() is not None
+
+    def _insert_many(
+        self,
+        items: Iterable[Tuple[int, int, str, Optional[int], Optional[str]]],
+        known: bool = False,
+    ) -> List[Optional[str]]:
+        # `known`: itens vindos da planilha/snapshot/diário; os já presentes
+        # são pulados (None) em vez de ocupar outra unidade.
+        conn = self._conn()
+        units: List[Optional[str]] = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for s, e, resource, lane, source in items:
+                if known and self._present(conn, s, e, resource, lane, source):
+                    units.append(None)
+                    continue
+                free = self._free_lanes(conn, resource, s, e)
+                if not free:
+                    units.append(None)
+                    continue
+                chosen = lane if lane in free else free[0]
+                conn.execute(
+                    "INSERT INTO lessons (resource, lane, start_min, end_min, source) VALUES (?, ?, ?, ?, ?)",
+                    (resource, chosen, s, e, source),
+                )
+                units.append(format_unit(resource, chosen))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return units
+
+    @staticmethod
+    def _minutes(
+        start: datetime, duration: timedelta, resource: str, unit: Optional[str], source: Optional[str] = None
+    ) -> Tuple[int, int, str, Optional[int], Optional[str]]:
+        s = to_minutes(start)
+        parsed = parse_unit(unit)
+        return s, s + duration // _MINUTE, resource, parsed[1] if parsed and parsed[0] == resource else None, source
+
+    def reserve(self, start: datetime, duration: timedelta, resource: str = DEFAULT_RESOURCE, unit: Optional[str] = None) -> Optional[str]:
+        return self._insert_many([self._minutes(start, duration, resource, unit)])[0]
+
+    def discard(self, start: datetime, resource: str = DEFAULT_RESOURCE, unit: Optional[str] = None) -> None:
+        parsed = parse_unit(unit)
+        if parsed is not None:
+            self._conn().execute(
+                "DELETE FROM lessons WHERE resource = ? AND lane = ? AND start_min = ?",
+                (resource, parsed[1], to_minutes(start)),
+            )
+        else:
+            self._conn().execute(
+                "DELETE FROM lessons WHERE rowid = ("
+                " SELECT rowid FROM lessons WHERE resource = ? AND start_min = ? LIMIT 1)",
+                (resource, to_minutes(start)),
+            )
+
+    def add_many(self, items: Iterable[Tuple[datetime, timedelta, str, Optional[str], Optional[str]]]) -> int:
+        return sum(1 for unit in self._insert_many((self._minutes(*item) for item in items), known=True) if unit)
+
+    def dump_intervals(self) -> List[Tuple[int, int, str, int, Optional[str]]]:
+        return self._conn().execute(
+            "SELECT start_min, end_min, resource, lane, source FROM lessons ORDER BY start_min, resource, lane"
+        ).fetchall()
+
+    def load_intervals(self, items: Iterable[Tuple[int, int, str, int, Optional[str]]]) -> int:
+        return sum(1 for unit in self._insert_many(items, known=True) if unit)
+
+    def between(self, start: datetime, end: datetime) -> List[str]:
+        rows = self._conn().execute(
+            "SELECT start_min FROM lessons WHERE start_min >= ? AND start_min < ? ORDER BY start_min",
+            (to_minutes(start), to_minutes(end)),
+        ).fetchall()
+        return [format_slot(from_minutes(r[0])) for r in rows]
+
+    def all(self) -> List[str]:
+        rows = self._conn().execute("SELECT start_min FROM lessons ORDER BY start_min").fetchall()
+        return [format_slot(from_minutes(r[0])) for r in rows]
+
+    def clear(self) -> None:
+        self._conn().execute("DELETE FROM lessons")
+
+
+class SqliteSessionStore(_SqliteBase):
+    """Sessões compartilhadas entre processos, com a mesma interface do SessionStore."""
+
+    def __init__(self, path: str, ttl: float = 1800.0, max_size: int = 10000, sweep_interval: float = 60.0, timeout: float = 10.0):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+        self.expired = 0
+        self.evicted = 0
+        super().__init__(path, timeout)
+
+    def _init_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " user_id TEXT PRIMARY KEY, fluxo TEXT, etapa TEXT, tipo_aula TEXT, nome TEXT,"
+            " last_seen REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)")
+
+    def get(self, user_id: str) -> Optional[SessionState]:
+        self._maybe_sweep()
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT fluxo, etapa, tipo_aula, nome, last_seen FROM sessions WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row[4] > self.ttl:
+            conn.execute("DELETE FROM sessions WHERE user_id = ? AND last_seen = ?", (user_id, row[4]))
+            self.expired += 1
+            return None
+        # Renovar o last_seen é uma escrita; só vale a pena quando ele já envelheceu.
+        if now - row[4] > self.ttl / 10:
+            conn.execute("UPDATE sessions SET last_seen = ? WHERE user_id = ?", (now, user_id))
+        return SessionState(fluxo=row[0], etapa=row[1], tipo_aula=row[2], nome=row[3])
+
+    def set(self, user_id: str, state: SessionState) -> None:
+        self._maybe_sweep()
+        self._conn().execute(
+            "INSERT INTO sessions (user_id, fluxo, etapa, tipo_aula, nome, last_seen) VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(user_id) DO UPDATE SET fluxo = excluded.fluxo, etapa = excluded.etapa,"
+            " tipo_aula = excluded.tipo_aula, nome = excluded.nome, last_seen = excluded.last_seen",
+            (user_id, state.fluxo, state.etapa, state.tipo_aula, state.nome, time.time()),
+        )
+
+    def delete(self, user_id: str) -> None:
+        self._conn().execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def _maybe_sweep(self) -> None:
+        if time.monotonic() - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+
+    def sweep(self) -> int:
+        self._last_sweep = time.monotonic()
+        conn = self._conn()
+        cur = conn.execute("DELETE FROM sessions WHERE last_seen < ?", (time.time() - self.ttl,))
+        self.expired += max(cur.rowcount, 0)
+        cur = conn.execute(
+            "DELETE FROM sessions WHERE user_id IN ("
+            " SELECT user_id FROM sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,),
+        )
+        self.evicted += max(cur.rowcount, 0)
+        return cur.rowcount
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        return {"sessions": len(self), "expired": self.expired, "evicted": self.evicted}
+
+
+class SqliteDedupCache(_SqliteBase):
+    """Ids de mensagens do webhook compartilhados entre processos.
+
+    Mesma interface do DedupCache: com vários workers, a reentrega do UltraMsg
+    pode cair em outro processo, que precisa saber que a mensagem já chegou.
+    `begin()` é um único INSERT (ou a retomada de um id já vencido), então só
+    um worker ganha cada mensagem.
+    """
+
+    def __init__(self, path: str, ttl: float = 600.0, max_size: int = 50000, sweep_interval: float = 60.0, timeout: float = 10.0):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+        super().__init__(path, timeout)
+
+    def _init_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS webhook_messages ("
+            " id TEXT PRIMARY KEY, received_at REAL NOT NULL, response TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS webhook_messages_received ON webhook_messages (received_at)")
+
+    def begin(self, key: str) -> Tuple[bool, Optional[Any]]:
+        if time.monotonic() - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+        now = time.time()
+        conn = self._conn()
+        cur = conn.execute(
+            "INSERT INTO webhook_messages (id, received_at) VALUES (?, ?)"
+            " ON CONFLICT(id) DO UPDATE SET received_at = excluded.received_at, response = NULL"
+            " WHERE webhook_messages.received_at < ?",
+            (key, now, now - self.ttl),
+        )
+        if cur.rowcount == 1:
+            return True, None
+        WEBHOOK_DUPLICATES.inc()
+        row = conn.execute("SELECT response FROM webhook_messages WHERE id = ?", (key,)).fetchone()
+        return False, row[0] if row else None
+
+    def complete(self, key: str, response: Any) -> None:
+        self._conn().execute("UPDATE webhook_messages SET response = ? WHERE id = ?", (response, key))
+
+    def forget(self, key: str) -> None:
+        self._conn().execute("DELETE FROM webhook_messages WHERE id = ?", (key,))
+
+    def sweep(self) -> int:
+        self._last_sweep = time.monotonic()
+        conn = self._conn()
+        removed = conn.execute("DELETE FROM webhook_messages WHERE received_at < ?", (time.time() - self.ttl,)).rowcount
+        removed += conn.execute(
+            "DELETE FROM webhook_messages WHERE id IN ("
+            " SELECT id FROM webhook_messages ORDER BY received_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,),
+        ).rowcount
+        return removed
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM webhook_messages").fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self)}
+
+
+class SqliteJournal(_SqliteBase):
+    """Diário de reservas pendentes compartilhado entre processos.
+
+    Mesma interface do BookingJournal. `pending()` reivindica as linhas para
+    o processo que vai enviá-las; se ele cair, a reivindicação expira após
+    `claim_timeout` segundos e outro worker assume o envio.
+    """
+
+    def __init__(self, path: str, claim_timeout: float = 60.0, timeout: float = 10.0):
+        self.claim_timeout = claim_timeout
+        self._owner = f"{os.getpid()}-{id(self)}"
+        super().__init__(path, timeout)
+
+    def _init_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS booking_outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, row TEXT NOT NULL,"
+            " claimed_by TEXT, claimed_at REAL)"
+        )
+
+    def append(self, row: List[str]) -> None:
+        self._conn().execute("INSERT INTO booking_outbox (row) VALUES (?)", (json.dumps(row, ensure_ascii=False),))
+
+    def pending(self) -> Tuple[List[List[str]], List[int]]:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE booking_outbox SET claimed_by = ?, claimed_at = ?"
+                " WHERE claimed_by IS NULL OR claimed_by = ? OR claimed_at < ?",
+                (self._owner, now, self._owner, now - self.claim_timeout),
+            )
+            rows = conn.execute(
+                "SELECT id, row FROM booking_outbox WHERE claimed_by = ? ORDER BY id", (self._owner,)
+            ).fetchall()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [json.loads(r[1]) for r in rows], [r[0] for r in rows]
+
+    def mark_flushed(self, ids: List[int]) -> None:
+        if not ids:
+            return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("DELETE FROM booking_outbox WHERE id = ?", ((i,) for i in ids))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def use_sqlite_backend(
+    path: str,
+    session_ttl: float = 1800.0,
+    max_sessions: int = 10000,
+    resource_capacities: Optional[Dict[str, int]] = None,
+) -> Dict[str, Any]:
+    """Liga sessões, índice de reservas e diário ao mesmo arquivo SQLite.
+
+    Retorna os argumentos `booking_index`/`journal` para `configure_google_sheets`.
+    """
+    from logic.integrations import configure_booking_index
+    from logic.state_manager import configure_sessions
+
+    configure_sessions(store=SqliteSessionStore(path, ttl=session_ttl, max_size=max_sessions))
+    index = SqliteBookingIndex(path, capacities=resource_capacities)
+    configure_booking_index(index)
+    return {"booking_index": index, "journal": SqliteJournal(path)}
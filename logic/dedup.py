@@ -0,0 +1,65 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import threading
+import time
+
+from logic.metrics import Counter
+
+WEBHOOK_DUPLICATES = Counter("bot_webhook_duplicates_total", "Reentregas do webhook descartadas pelo id da mensagem.")
+
+_PENDING = object()
+
+
+class DedupCache:
+    """Ids de mensagens já recebidas, com validade e limite de tamanho (LRU).
+
+    `begin()` marca o id como em processamento antes de qualquer trabalho,
+    então uma reentrega que chega no meio do processamento também é barrada.
+    Depois de `complete()`, a reentrega recebe a resposta guardada.
+
+    Vale só dentro do processo: com vários workers (STATE_DB_PATH), use o
+    SqliteDedupCache de logic/backends.py.
+    """
+
+    def __init__(self, ttl: float = 600.0, max_size: int = 50000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def begin(self, key: str) -> Tuple[bool, Optional[Any]]:
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                WEBHOOK_DUPLICATES.inc()
+                return False, None if entry[1] is _PENDING else entry[1]
+            self._entries[key] = (now, _PENDING)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return True, None
+
+    def complete(self, key: str, response: Any) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], response)
+
+    def forget(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _expire(self, now: float) -> None:
+        # Ordem de chegada = ordem de expiração: só olha o começo da fila.
+        while self._entries:
+            first = next(iter(self._entries.values()))
+            if now - first[0] <= self.ttl:
+                break
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries)}
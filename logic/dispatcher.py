@@ -0,0 +1,99 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Optional, Tuple
+import asyncio
+
+from logic.metrics import Counter, Gauge
+
+DISPATCH_COALESCED = Counter("bot_dispatch_coalesced_total", "Mensagens repetidas em sequência agrupadas numa só.")
+DISPATCH_QUEUED = Gauge("bot_dispatch_queued", "Mensagens esperando na fila dos usuários.")
+
+
+class UserDispatcher:
+    """Processa as mensagens de cada usuário em ordem, uma por vez.
+
+    Cada `user_id` tem a sua fila; usuários diferentes andam em paralelo até
+    `max_concurrency`. O trabalho bloqueante (`handler`, ex.: `executar_acao`)
+    roda num pool de threads limitado, fora do event loop.
+
+    Com `coalesce`, mensagens idênticas seguidas na fila (toques repetidos)
+    são processadas uma vez só; as repetidas recebem `None` e não devem gerar
+    outra resposta.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str, str], str],
+        max_concurrency: int = 32,
+        max_workers: int = 8,
+        coalesce: bool = True,
+    ):
+        self.handler = handler
+        self.coalesce = coalesce
+        self._max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._mailboxes: Dict[str, Deque[Tuple[str, asyncio.Future]]] = {}
+
+    async def submit(self, user_id: str, message: str) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="dispatch")
+
+        future = loop.create_future()
+        mailbox = self._mailboxes.get(user_id)
+        if mailbox is None:
+            mailbox = self._mailboxes[user_id] = deque()
+            mailbox.append((message, future))
+            loop.create_task(self._drain(user_id, mailbox))
+        else:
+            mailbox.append((message, future))
+        DISPATCH_QUEUED.inc()
+        return await future
+
+    async def _drain(self, user_id: str, mailbox: Deque[Tuple[str, asyncio.Future]]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while mailbox:
+                message, future = mailbox.popleft()
+                DISPATCH_QUEUED.dec()
+
+                duplicates = []
+                while self.coalesce and mailbox and mailbox[0][0] == message:
+                    duplicates.append(mailbox.popleft()[1])
+                    DISPATCH_QUEUED.dec()
+                    DISPATCH_COALESCED.inc()
+
+                try:
+                    async with self._semaphore:
+                        result = await loop.run_in_executor(self._executor, self.handler, message, user_id)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                for dup in duplicates:
+                    if not dup.done():
+                        dup.set_result(None)
+        finally:
+            # A fila só some quando esvazia; quem chegar depois cria outra.
+            if self._mailboxes.get(user_id) is mailbox:
+                del self._mailboxes[user_id]
+            while mailbox:
+                _, future = mailbox.popleft()
+                DISPATCH_QUEUED.dec()
+                future.cancel()
+
+    def pending(self) -> int:
+        return sum(len(m) for m in self._mailboxes.values())
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
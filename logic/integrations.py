@@ -1,14 +1,60 @@
-from typing import Dict, List, Optional, Any
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Tuple, Union
+import os
 import threading
-
-_booked_slots = set()
-_lock = threading.RLock()
+import time
+
+from logic.slots import (
+    SlotIndex,
+    format_slot,
+    lesson_duration,
+    lesson_resource,
+    next_free_slots,
+    parse_slot,
+    within_opening_hours,
+)
+from logic.metrics import BOOKINGS, timed, timed_stage
+from logic.snapshot import load_snapshot, save_snapshot
+from logic.journal import BookingJournal, WriteBehindFlusher
+
+# Índice das aulas reservadas (da planilha e das reservas ainda não
+# gravadas), com a unidade de recurso (instrutor, vaga na sala) de cada uma.
+# Pode ser trocado por um compartilhado entre processos, ver
+# logic/backends.py. Nenhuma trava é mantida durante chamadas de rede.
+_index: Any = SlotIndex()
+_cache_lock = threading.Lock()
 
 _use_sheets = False
 _sheets_client = None
 _sheet_id: Optional[str] = None
 _worksheet_name: str = "Sheet1"
-_cache: Optional[set] = None
+_worksheet = None
+
+# `_rows_read` marca até qual linha a planilha já foi lida; as atualizações
+# buscam só as linhas novas.
+_cache_loaded = False
+_rows_read = 0
+_cache_ttl: Optional[float] = 60.0
+_last_refresh = 0.0
+_refreshing = False
+# Conteúdo da última linha lida, para conferir no próximo boot se a
+# planilha não foi reordenada/apagada desde o snapshot.
+_last_row_key = ""
+
+# Snapshot local do índice (ver logic/snapshot.py): no boot, carrega o
+# arquivo e busca só as linhas adicionadas depois dele.
+_snapshot_path: Optional[str] = None
+_snapshot_interval = 300.0
+_last_snapshot = 0.0
+
+_journal: Any = None
+_flusher: Optional[WriteBehindFlusher] = None
+
+# Preparação do Sheets (import do gspread, autenticação, carga da planilha).
+# "idle" = Sheets não configurado; até "ready", reservas são recusadas com
+# status "unavailable" em vez de cair no índice sem persistência.
+_sheets_config: Optional[dict] = None
+_warmup: Dict[str, Any] = {"state": "idle", "error": None, "started_at": None, "elapsed": None, "attempts": 0}
 
 
 def configure_google_sheets(
@@ -18,20 +64,63 @@ def configure_google_sheets(
     sheet_id: Optional[str] = None,
     worksheet_name: str = "Sheet1",
     use_cache: bool = True,
+    cache_ttl: Optional[float] = 60.0,
+    journal_path: Optional[str] = "agendamentos.journal",
+    flush_batch_size: int = 50,
+    flush_interval: float = 2.0,
+    booking_index: Any = None,
+    journal: Any = None,
+    background: bool = False,
+    snapshot_path: Optional[str] = "agendamentos.snapshot",
+    snapshot_interval: float = 300.0,
+    resource_capacities: Optional[Dict[str, int]] = None,
 ) -> None:
-    global _use_sheets, _sheets_client, _sheet_id, _worksheet_name, _cache
+    global _use_sheets, _sheets_client, _sheet_id, _worksheet_name, _worksheet, _cache_ttl, _sheets_config
+    global _snapshot_path, _snapshot_interval
 
     if client is None and credentials_json_path is None and credentials_json_dict is None:
         raise ValueError("Forneça `client` ou `credentials_json_path`/`credentials_json_dict` para usar Google Sheets.")
 
+    stop_write_behind()
     _worksheet_name = worksheet_name
     _sheet_id = sheet_id
-
-    if client is not None:
-        _sheets_client = client
-        _use_sheets = True
-        _cache = set() if use_cache else None
-        return
+    _worksheet = None
+    _sheets_client = None
+    _use_sheets = True
+    # Sem cache, cada consulta busca as linhas novas antes de responder.
+    _cache_ttl = cache_ttl if use_cache else 0.0
+    _snapshot_path = snapshot_path
+    _snapshot_interval = snapshot_interval
+    configure_booking_index(booking_index if booking_index is not None else SlotIndex(resource_capacities))
+
+    _sheets_config = {
+        "client": client,
+        "credentials_json_path": credentials_json_path,
+        "credentials_json_dict": credentials_json_dict,
+        "journal": journal,
+        "journal_path": journal_path,
+        "flush_batch_size": flush_batch_size,
+        "flush_interval": flush_interval,
+    }
+    _set_warmup("pending")
+
+    # Em segundo plano, o import do gspread, a autenticação e a carga da
+    # planilha ficam para `start_sheets_warmup()` (chamado no lifespan do app).
+    if not background:
+        warm_up_google_sheets()
+
+
+def _set_warmup(state: str, **extra: Any) -> None:
+    with _cache_lock:
+        _warmup["state"] = state
+        _warmup.update(extra)
+        if state == "pending":
+            _warmup.update(error=None, started_at=None, elapsed=None, attempts=0)
+
+
+def _create_sheets_client(config: dict) -> Any:
+    if config["client"] is not None:
+        return config["client"]
 
     try:
         import gspread
@@ -43,20 +132,76 @@ def configure_google_sheets(
             f"Erro interno: {e}"
         )
 
-    if credentials_json_path:
-        _sheets_client = gspread.service_account(filename=credentials_json_path)
-    else:
-        creds = Credentials.from_service_account_info(credentials_json_dict)
-        _sheets_client = gspread.Client(auth=creds)
-        _sheets_client.session = gspread.client.Session()
+    if config["credentials_json_path"]:
+        return gspread.service_account(filename=config["credentials_json_path"])
+    creds = Credentials.from_service_account_info(config["credentials_json_dict"])
+    client = gspread.Client(auth=creds)
+    client.session = gspread.client.Session()
+    return client
 
-    _use_sheets = True
-    _cache = set() if use_cache else None
-    if _cache is not None and _sheet_id:
+
+def warm_up_google_sheets() -> None:
+    global _sheets_client
+
+    config = _sheets_config
+    if config is None:
+        return
+    started = time.monotonic()
+    _set_warmup("warming", started_at=time.time(), attempts=_warmup["attempts"] + 1)
+    try:
+        client = _create_sheets_client(config)
+    except Exception as e:
+        _set_warmup("failed", error=str(e))
+        raise
+
+    _sheets_client = client
+    if _sheet_id:
         try:
-            _cache.update(_read_all_slots_from_sheet())
-        except Exception:
-            _cache = None
+            if not _load_slot_snapshot():
+                refresh_slot_cache()
+        except Exception as e:
+            print("Erro ao carregar horários da planilha (nova tentativa na próxima consulta):", e)
+
+    journal = config["journal"]
+    if journal is None and config["journal_path"]:
+        journal = BookingJournal(config["journal_path"])
+    _start_write_behind(journal, config["flush_batch_size"], config["flush_interval"])
+    _set_warmup("ready", error=None, elapsed=time.monotonic() - started, rows=_rows_read)
+    save_slot_snapshot()
+
+
+def start_sheets_warmup(max_backoff: float = 60.0) -> Optional[threading.Thread]:
+    if _warmup["state"] != "pending":
+        return None
+
+    def run():
+        delay = 1.0
+        while _warmup["state"] != "ready":
+            try:
+                warm_up_google_sheets()
+            except Exception as e:
+                print(f"Erro ao preparar o Google Sheets (nova tentativa em {delay:.0f}s):", e)
+                time.sleep(delay)
+                delay = min(delay * 2, max_backoff)
+
+    thread = threading.Thread(target=run, name="sheets-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def sheets_ready() -> bool:
+    return _warmup["state"] in ("ready", "idle")
+
+
+def warmup_status() -> Dict[str, Any]:
+    with _cache_lock:
+        return dict(_warmup)
+
+
+def configure_booking_index(index: Any) -> None:
+    global _index
+    _index = index
+    _reset_refresh_state()
 
 
 def use_google_sheets() -> bool:
@@ -64,96 +209,367 @@ def use_google_sheets() -> bool:
 
 
 def _get_worksheet():
+    global _worksheet
     if not use_google_sheets():
         raise RuntimeError("Google Sheets não está configurado. Use `configure_google_sheets(...)`.")
-    ws = _sheets_client.open_by_key(_sheet_id).worksheet(_worksheet_name)
-    return ws
+    if _worksheet is None:
+        _worksheet = _sheets_client.open_by_key(_sheet_id).worksheet(_worksheet_name)
+    return _worksheet
+
+
+def _invalidate_worksheet() -> None:
+    global _worksheet
+    _worksheet = None
+
+
+def _slot_from_row(row: List[str]) -> Optional[str]:
+    if not row:
+        return None
+    first = row[2].strip() if len(row) > 2 else ""
+    if not first:
+        return None
+    if first.lower() == "slot" or first.lower() == "horario":
+        return None
+    return first
+
+
+def _lesson_from_row(
+    row: List[str], number: Optional[int] = None
+) -> Optional[Tuple[datetime, timedelta, str, Optional[str], Optional[str]]]:
+    # Colunas: nome, tipo, horário, user_id e a unidade reservada. Linhas
+    # antigas não têm a última: ocupam a primeira unidade livre e são
+    # reconhecidas numa releitura pelo número da linha (`number`, a partir de 1).
+    slot = _slot_from_row(row)
+    start = parse_slot(slot) if slot else None
+    if start is None:
+        return None
+    tipo = row[1].strip() if len(row) > 1 else None
+    unit = (row[4].strip() if len(row) > 4 else "") or None
+    source = f"linha-{number}" if unit is None and number is not None else None
+    return start, lesson_duration(tipo), lesson_resource(tipo), unit, source
+
+
+def _lessons_from_rows(rows: List[List[str]], first_number: int) -> List[Tuple[datetime, timedelta, str, Optional[str], Optional[str]]]:
+    lessons = (_lesson_from_row(row, first_number + i) for i, row in enumerate(rows))
+    return [lesson for lesson in lessons if lesson]
 
 
-def _read_all_slots_from_sheet() -> List[str]:
+def _read_booking_keys_from_sheet() -> set:
     ws = _get_worksheet()
-    rows = ws.get_all_values()
-    slots = []
+    return {_row_key(row) for row in ws.get_all_values() if _slot_from_row(row)}
+
+
+def _read_rows_since(start: int) -> List[List[str]]:
+    ws = _get_worksheet()
+    try:
+        if start == 0:
+            rows = ws.get_all_values()
+        else:
+            rows = ws.get_values(f"A{start + 1}:E")
+    except Exception:
+        _invalidate_worksheet()
+        raise
+    # Linhas vazias no fim não contam: a próxima gravação vai ocupá-las.
+    while rows and not any(rows[-1]):
+        rows.pop()
+    return rows
+
+
+def _reset_refresh_state() -> None:
+    global _cache_loaded, _rows_read, _last_refresh, _last_row_key
+    with _cache_lock:
+        _cache_loaded = False
+        _rows_read = 0
+        _last_refresh = 0.0
+        _last_row_key = ""
+
+
+def _row_key(row: List[str]) -> str:
+    return "\t".join(cell.strip() for cell in row[:5])
+
+
+def _snapshot_key() -> str:
+    return f"{_sheet_id}/{_worksheet_name}"
+
+
+def _load_slot_snapshot() -> bool:
+    global _cache_loaded, _rows_read, _last_refresh, _last_row_key
+
+    if not _snapshot_path:
+        return False
+    snap = load_snapshot(_snapshot_path, _snapshot_key())
+    if snap is None:
+        if os.path.exists(_snapshot_path):
+            print("Snapshot da agenda inválido ou de outra planilha; recarregando a planilha inteira.")
+        return False
+
+    # Relê a partir da última linha do snapshot: ela tem que continuar igual,
+    # senão a planilha mudou por baixo (linhas apagadas/ordenadas).
+    rows: List[List[str]] = []
+    if snap.rows_read:
+        with timed("sheets_refresh"):
+            rows = _read_rows_since(snap.rows_read - 1)
+        if not rows or _row_key(rows[0]) != snap.last_row:
+            print("Planilha mudou desde o snapshot; recarregando a planilha inteira.")
+            return False
+        rows = rows[1:]
+
+    with _cache_lock:
+        _index.load_intervals(snap.intervals)
+        _index.add_many(_lessons_from_rows(rows, snap.rows_read + 1))
+        _rows_read = snap.rows_read + len(rows)
+        _last_row_key = _row_key(rows[-1]) if rows else snap.last_row
+        _cache_loaded = True
+        _last_refresh = time.monotonic()
+    return True
+
+
+def save_slot_snapshot() -> bool:
+    global _last_snapshot
+
+    if not _snapshot_path or not _cache_loaded:
+        return False
+    with _cache_lock:
+        rows_read, last_row = _rows_read, _last_row_key
+        intervals = _index.dump_intervals()
+    try:
+        save_snapshot(_snapshot_path, _snapshot_key(), rows_read, last_row, intervals)
+    except OSError as e:
+        print("Erro ao gravar snapshot da agenda:", e)
+        return False
+    _last_snapshot = time.monotonic()
+    return True
+
+
+def refresh_slot_cache(full: bool = False) -> int:
+    global _cache_loaded, _rows_read, _last_refresh, _last_row_key
+
+    # A releitura completa não limpa o índice: ele também guarda reservas
+    # que ainda estão no diário, esperando para ir à planilha.
+    if full:
+        _reset_refresh_state()
+    start = _rows_read
+    with timed("sheets_refresh"):
+        rows = _read_rows_since(start)
+
+    with _cache_lock:
+        # Outra thread já aplicou essa leitura enquanto esperávamos a rede.
+        if _rows_read != start:
+            return 0
+        added = _index.add_many(_lessons_from_rows(rows, start + 1))
+        _rows_read += len(rows)
+        if rows:
+            _last_row_key = _row_key(rows[-1])
+        _cache_loaded = True
+        _last_refresh = time.monotonic()
+        return added
+
+
+def _maybe_refresh() -> None:
+    global _refreshing
+
+    if _cache_loaded and _cache_ttl is None:
+        return
+    if _cache_loaded and time.monotonic() - _last_refresh < _cache_ttl:
+        return
+
+    with _cache_lock:
+        # Com o índice carregado, uma atualização em andamento basta.
+        if _refreshing and _cache_loaded:
+            return
+        _refreshing = True
+    try:
+        if refresh_slot_cache() and time.monotonic() - _last_snapshot >= _snapshot_interval:
+            save_slot_snapshot()
+    except Exception:
+        # Com o índice já carregado, servir um dado um pouco antigo é melhor
+        # que recusar a consulta; sem ele, quem chamou decide o fallback.
+        if not _cache_loaded:
+            raise
+    finally:
+        _refreshing = False
+
+
+def _start_write_behind(journal: Any, batch_size: int, interval: float) -> None:
+    global _journal, _flusher
+
+    stop_write_behind()
+    if _journal is not None and _journal is not journal:
+        _journal.close()
+    _journal = journal
+    if journal is None:
+        return
+
+    _replay_journal(_journal)
+    _flusher = WriteBehindFlusher(_journal, _flush_rows_to_sheet, batch_size, interval)
+    _flusher.start()
+
+
+def _replay_journal(journal: Any) -> None:
+    # Reservas confirmadas que não chegaram à planilha antes do processo cair.
+    rows, end = journal.pending()
+    if not rows:
+        return
+
+    # Compara com a planilha e não com o índice: com um índice compartilhado,
+    # ele já contém as reservas pendentes de outros workers.
+    try:
+        in_sheet = _read_booking_keys_from_sheet()
+    except Exception:
+        in_sheet = set()
+
+    # O lote pode ter sido enviado sem que o offset fosse gravado: só
+    # reenfileira o que a planilha ainda não tem.
+    seen = set()
     for row in rows:
-        if not row:
-            continue
-        first = row[2].strip() if len(row) > 2 else ""
-        if not first:
+        key = _row_key(row)
+        if key in in_sheet or key in seen:
             continue
-        if first.lower() == "slot" or first.lower() == "horario":
-            continue
-        slots.append(first)
-    return slots
+        seen.add(key)
+        journal.append(row)
+        # Se o snapshot já trouxe a aula, a unidade gravada na linha faz o
+        # índice reconhecê-la em vez de ocupar outra.
+        lesson = _lesson_from_row(row)
+        if lesson:
+            _index.add_many([lesson])
+    journal.mark_flushed(end)
 
 
-def _append_slot_to_sheet(info: dict) -> None:
+def _flush_rows_to_sheet(rows: List[List[str]]) -> None:
     ws = _get_worksheet()
-    ws.append_row([info["nome"], info["tipo"], info["slot"], info["user_id"]])
+    try:
+        with timed("sheets_flush"):
+            ws.append_rows(rows, value_input_option="RAW")
+    except Exception:
+        _invalidate_worksheet()
+        raise
 
 
-def _sheet_has_slot(slot: str) -> bool:
-    if _cache is not None:
-        return slot in _cache
-    slots = _read_all_slots_from_sheet()
-    return slot in slots
+def flush_bookings() -> int:
+    if _flusher is None:
+        return 0
+    return _flusher.flush()
 
 
-def calendar_api_check_availability(slot: str) -> bool:
-    if use_google_sheets():
-        with _lock:
-            try:
-                available = not _sheet_has_slot(slot)
-            except Exception:
-                available = slot not in _booked_slots
-            return available
-    with _lock:
-        return slot not in _booked_slots
+def stop_write_behind() -> None:
+    global _flusher
+    if _flusher is not None:
+        _flusher.stop()
+        _flusher = None
 
 
-def calendar_api_book_slot(info: dict) -> Dict[str, str]:
-    slot = info["slot"]
-
-    if use_google_sheets():
-        with _lock:
-            try:
-                if _sheet_has_slot(slot):
-                    return {"status": "conflict", "slot": slot}
+def _append_slot_to_sheet(info: dict) -> None:
+    ws = _get_worksheet()
+    try:
+        with timed("sheets_append"):
+            ws.append_row([info["nome"], info["tipo"], info["slot"], info["user_id"], info["unit"]])
+    except Exception:
+        _invalidate_worksheet()
+        raise
 
-                _append_slot_to_sheet(info)
 
-                if _cache is not None:
-                    _cache.add(slot)
+def _parse_request(slot: str, tipo: Optional[str]) -> Tuple[Optional[datetime], timedelta]:
+    return parse_slot(slot), lesson_duration(tipo)
 
-                return {"status": "booked", "slot": slot}
 
-            except Exception as e:
-                return {"status": "error", "slot": slot, "reason": str(e)}
+@timed_stage("check_availability")
+def calendar_api_check_availability(slot: str, tipo: Optional[str] = None) -> bool:
+    if not sheets_ready():
+        return False
+    start, duration = _parse_request(slot, tipo)
+    if start is None or not within_opening_hours(start, duration) or start <= datetime.now():
+        return False
+    if use_google_sheets():
+        try:
+            _maybe_refresh()
+        except Exception:
+            pass
+    return _index.is_free(start, duration, lesson_resource(tipo))
 
-    with _lock:
-        if slot in _booked_slots:
-            return {"status": "conflict", "slot": slot}
-        _booked_slots.add(slot)
-        return {"status": "booked", "slot": slot}
 
+@timed_stage("book_slot")
+def calendar_api_book_slot(info: dict) -> Dict[str, str]:
+    try:
+        result = _book_slot(info)
+    except Exception:
+        BOOKINGS.inc("error")
+        raise
+    BOOKINGS.inc(result["status"])
+    return result
+
+
+def _book_slot(info: dict) -> Dict[str, str]:
+    start, duration = _parse_request(info["slot"], info.get("tipo"))
+    if start is None:
+        return {"status": "invalid", "slot": info["slot"], "reason": "formato de data inválido"}
+    slot = format_slot(start)
+    if not within_opening_hours(start, duration):
+        return {"status": "invalid", "slot": slot, "reason": "fora do horário de funcionamento"}
+    if start <= datetime.now():
+        return {"status": "invalid", "slot": slot, "reason": "esse horário já passou"}
+    if not sheets_ready():
+        return {"status": "unavailable", "slot": slot, "reason": "agenda ainda carregando"}
+    resource = lesson_resource(info.get("tipo"))
 
-def list_booked_slots() -> List[str]:
     if use_google_sheets():
-        with _lock:
-            try:
-                if _cache is not None:
-                    return sorted(list(_cache))
-                return sorted(_read_all_slots_from_sheet())
-            except Exception:
-                pass
+        try:
+            _maybe_refresh()
+        except Exception as e:
+            return {"status": "error", "slot": slot, "reason": str(e)}
+
+        # A reserva no índice é atômica (sobreposição e capacidade incluídas)
+        # e não envolve rede.
+        unit = _index.reserve(start, duration, resource)
+        if not unit:
+            return {"status": "conflict", "slot": slot}
 
-    with _lock:
-        return sorted(list(_booked_slots))
+        # Referências locais: stop_write_behind() pode zerar _flusher em outra
+        # thread no meio da reserva.
+        journal, flusher = _journal, _flusher
+        try:
+            if journal is not None:
+                journal.append([info["nome"], info["tipo"], slot, info["user_id"], unit])
+            else:
+                # Sem diário, a gravação é síncrona: a unidade fica reservada
+                # no índice durante a chamada e é liberada se ela falhar.
+                _append_slot_to_sheet(dict(info, slot=slot, unit=unit))
+        except Exception as e:
+            _index.discard(start, resource, unit)
+            return {"status": "error", "slot": slot, "reason": str(e)}
+        # Fora do try: com a linha já no diário, a reserva está feita. Sem
+        # flusher (desligando), ela vai para a planilha no próximo boot.
+        if journal is not None and flusher is not None:
+            flusher.notify()
+        return {"status": "booked", "slot": slot, "unit": unit}
+
+    unit = _index.reserve(start, duration, resource)
+    if not unit:
+        return {"status": "conflict", "slot": slot}
+    return {"status": "booked", "slot": slot, "unit": unit}
+
+
+def calendar_api_next_free_slots(
+    after: Union[str, datetime],
+    count: int = 3,
+    tipo: Optional[str] = None,
+) -> List[str]:
+    if isinstance(after, str):
+        after = parse_slot(after)
+        if after is None:
+            after = datetime.now()
+    return next_free_slots(_index, after, count, lesson_duration(tipo), lesson_resource(tipo))
+
+
+def list_booked_slots(start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[str]:
+    if use_google_sheets():
+        try:
+            _maybe_refresh()
+        except Exception:
+            pass
+    if start is None and end is None:
+        return _index.all()
+    return _index.between(start or datetime.min, end or datetime.max)
 
 
 def reset_bookings() -> None:
-    with _lock:
-        if use_google_sheets():
-            if _cache is not None:
-                _cache.clear()
-        else:
-            _booked_slots.clear()
+    _index.clear()
@@ -0,0 +1,155 @@
+from typing import Callable, List, Optional, Tuple
+import json
+import os
+import threading
+
+
+class BookingJournal:
+    """Diário local (append-only) das reservas ainda não gravadas na planilha.
+
+    Cada reserva é uma linha JSON gravada com fsync antes de ser confirmada ao
+    aluno. O arquivo `<path>.offset` guarda até onde o diário já foi enviado
+    ao Google Sheets; tudo depois desse ponto é reenviado ao reiniciar.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def append(self, row: List[str]) -> None:
+        line = (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            os.write(self._fd, line)
+        # O fsync fica fora da trava: gravações concorrentes são confirmadas
+        # juntas pelo mesmo flush do sistema de arquivos.
+        os.fsync(self._fd)
+
+    def _read_offset(self) -> int:
+        try:
+            with open(self.offset_path, "r") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_offset(self, offset: int) -> None:
+        tmp = self.offset_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.offset_path)
+
+    def pending(self) -> Tuple[List[List[str]], int]:
+        with self._lock:
+            start = self._read_offset()
+            # Offset além do fim: o diário foi truncado depois de uma gravação
+            # do offset que não chegou ao disco; tudo no arquivo está pendente.
+            if start > os.fstat(self._fd).st_size:
+                start = 0
+            with open(self.path, "rb") as f:
+                f.seek(start)
+                data = f.read()
+
+        rows = []
+        end = start
+        for line in data.splitlines(keepends=True):
+            # Linha incompleta = gravação interrompida no meio; fica para depois.
+            if not line.endswith(b"\n"):
+                break
+            end += len(line)
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                continue
+        return rows, end
+
+    def mark_flushed(self, offset: int) -> None:
+        with self._lock:
+            if offset >= os.fstat(self._fd).st_size:
+                # Zera o offset antes de truncar: uma queda entre os dois passos
+                # deixa no máximo linhas já enviadas para reenviar (o replay
+                # descarta as que a planilha já tem), nunca um offset grande
+                # sobre um arquivo vazio, que esconderia as próximas reservas.
+                self._write_offset(0)
+                os.ftruncate(self._fd, 0)
+                os.fsync(self._fd)
+                return
+            self._write_offset(offset)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fd >= 0:
+                os.close(self._fd)
+                self._fd = -1
+
+
+class WriteBehindFlusher:
+    """Envia as reservas do diário para a planilha em lotes, numa thread própria.
+
+    O envio acontece quando `batch_size` reservas se acumulam ou a cada
+    `interval` segundos, o que vier primeiro.
+    """
+
+    def __init__(
+        self,
+        journal: BookingJournal,
+        flush_rows: Callable[[List[List[str]]], None],
+        batch_size: int = 50,
+        interval: float = 2.0,
+    ):
+        self.journal = journal
+        self.flush_rows = flush_rows
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queued = 0
+        self._count_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sheets-flusher", daemon=True)
+        self._thread.start()
+
+    def notify(self) -> None:
+        with self._count_lock:
+            self._queued += 1
+            if self._queued >= self.batch_size:
+                self._wake.set()
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._count_lock:
+                self._queued = 0
+            rows, end = self.journal.pending()
+            if not rows:
+                return 0
+            self.flush_rows(rows)
+            self.journal.mark_flushed(end)
+            return len(rows)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print("Erro ao gravar reservas na planilha (nova tentativa em breve):", e)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            print("Erro ao gravar reservas pendentes na planilha:", e)
@@ -0,0 +1,97 @@
+from typing import Optional
+
+import httpx
+
+from logic.metrics import ULTRAMSG_SENDS, timed
+
+ULTRAMSG_BASE_URL = "https://api.ultramsg.com"
+
+
+class SendError(Exception):
+    # `retryable`: vale tentar de novo (429, 5xx, falha de rede); `retry_after`
+    # vem do cabeçalho Retry-After, quando o UltraMsg manda.
+    def __init__(self, reason: str, retryable: bool = True, retry_after: Optional[float] = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    try:
+        return max(0.0, float(resp.headers.get("Retry-After", "")))
+    except ValueError:
+        return None
+
+
+class UltraMsgClient:
+    def __init__(
+        self,
+        instance_id: Optional[str],
+        token: Optional[str],
+        base_url: str = ULTRAMSG_BASE_URL,
+        timeout: float = 10.0,
+        connect_timeout: float = 3.0,
+        max_connections: int = 20,
+        max_keepalive: int = 10,
+        keepalive_expiry: float = 30.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.instance_id = instance_id
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self._timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Criado sob demanda para ficar preso ao event loop do uvicorn.
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self._timeout,
+                limits=self._limits,
+                transport=self._transport,
+            )
+        return self._client
+
+    async def send_once(self, to: str, body: str) -> None:
+        """Uma tentativa de envio; levanta SendError se o UltraMsg não aceitar."""
+        try:
+            with timed("ultramsg_send"):
+                await self._post(to, body)
+        except SendError as e:
+            ULTRAMSG_SENDS.inc("throttled" if e.reason == "HTTP 429" else "error")
+            raise
+        ULTRAMSG_SENDS.inc("ok")
+
+    async def _post(self, to: str, body: str) -> None:
+        url = f"/{self.instance_id}/messages/chat"
+        payload = {"token": self.token, "to": to, "body": body}
+        try:
+            resp = await self._get_client().post(url, data=payload)
+        except httpx.TransportError as e:
+            raise SendError(f"{type(e).__name__}: {e}") from e
+
+        if resp.status_code == 429 or resp.status_code >= 500:
+            raise SendError(f"HTTP {resp.status_code}", retry_after=_retry_after(resp))
+        if not resp.is_success:
+            raise SendError(f"HTTP {resp.status_code}: {resp.text[:200]}", retryable=False)
+        # O UltraMsg responde 200 com {"error": ...} para token inválido,
+        # número inexistente etc.
+        try:
+            data = resp.json()
+        except ValueError:
+            return
+        if isinstance(data, dict) and data.get("error"):
+            raise SendError(f"UltraMsg: {data['error']}", retryable=False)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
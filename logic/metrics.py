@@ -0,0 +1,268 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import cProfile
+import itertools
+import pstats
+import random
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List["_Metric"] = []
+_collectors: List[Callable[[], List[str]]] = []
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # Por rótulo: contagem por bucket (não cumulativa), soma e total.
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v[0]), v[1], v[2]) for k, v in self._values.items()]
+        lines = self._header()
+        for labels, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("bot_stage_duration_seconds", "Tempo gasto em cada etapa do atendimento.", ["stage"])
+# Etapas curtas de CPU medidas por amostragem (`sampled_stage`): série à parte
+# para que `_count`/`_sum` não se misturem com as etapas contadas uma a uma.
+STAGE_SAMPLED_SECONDS = Histogram(
+    "bot_stage_sampled_duration_seconds",
+    "Tempo de etapas curtas medido em 1 de cada `every` chamadas; _count e _sum são só da amostra.",
+    ["stage", "every"],
+)
+STAGE_INFLIGHT = Gauge("bot_stage_inflight", "Chamadas em andamento por etapa.", ["stage"])
+BOOKINGS = Counter("bot_bookings_total", "Resultados das tentativas de reserva.", ["status"])
+ULTRAMSG_SENDS = Counter("bot_ultramsg_sends_total", "Mensagens enviadas ao UltraMsg por resultado.", ["result"])
+
+
+def register_collector(collector: Callable[[], List[str]]) -> None:
+    # Métricas calculadas na hora da coleta (ex.: estatísticas de cache),
+    # sem custo nenhum no caminho das mensagens.
+    _collectors.append(collector)
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    for collector in _collectors:
+        try:
+            lines.extend(collector())
+        except Exception as e:
+            lines.append(f"# erro no coletor {getattr(collector, '__name__', collector)}: {e}")
+    return "\n".join(lines) + "\n"
+
+
+class timed:
+    """Mede uma etapa: `with timed("book_slot"): ...`.
+
+    Classe com __slots__ em vez de @contextmanager para custar o mínimo
+    possível no caminho de cada mensagem.
+    """
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self) -> "timed":
+        STAGE_INFLIGHT.inc(self.stage)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, self.stage)
+        STAGE_INFLIGHT.dec(self.stage)
+
+
+def timed_stage(stage: str):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def sampled_stage(stage: str, every: int = 16):
+    """Como `timed_stage`, para etapas curtas de CPU (microssegundos).
+
+    Mede só 1 em cada `every` chamadas e não mexe em `bot_stage_inflight`:
+    as outras custam um contador a mais. Vai para
+    `bot_stage_sampled_duration_seconds{every="N"}`: os percentis valem
+    igual, mas `_count` e `_sum` são da amostra (multiplique por N).
+    """
+    def decorator(fn):
+        calls = itertools.count()
+        every_label = str(every)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if next(calls) % every:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                STAGE_SAMPLED_SECONDS.observe(time.perf_counter() - start, stage, every_label)
+        return wrapper
+    return decorator
+
+
+_caches: Dict[str, Callable] = {}
+
+
+def register_cache(name: str, cached_fn: Callable) -> None:
+    # Funções com @lru_cache: acertos e falhas vêm de cache_info() na coleta.
+    _caches[name] = cached_fn
+
+
+def _collect_caches() -> List[str]:
+    infos = [(name, fn.cache_info()) for name, fn in _caches.items()]
+    lines = []
+    for metric, kind, attr, help in (
+        ("bot_cache_hits_total", "counter", "hits", "Acertos de cache."),
+        ("bot_cache_misses_total", "counter", "misses", "Falhas de cache."),
+        ("bot_cache_size", "gauge", "currsize", "Entradas no cache."),
+    ):
+        lines += [f"# HELP {metric} {help}", f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{cache="{name}"}} {getattr(info, attr)}' for name, info in infos]
+    return lines
+
+
+register_collector(_collect_caches)
+
+
+# Perfilamento por amostragem do caminho quente: com `sample_rate` > 0, uma
+# fração das mensagens roda sob cProfile e as estatísticas se acumulam até
+# `dump_profile()` (leia com `python -m pstats <arquivo>`).
+_profile_rate = 0.0
+_profile_stats: Optional[pstats.Stats] = None
+_profile_lock = threading.Lock()
+_profiling = False
+
+
+def configure_profiling(sample_rate: float) -> None:
+    global _profile_rate, _profile_stats
+    _profile_rate = sample_rate
+    _profile_stats = None
+
+
+@contextmanager
+def sampled_profile() -> Iterator[None]:
+    global _profiling, _profile_stats
+
+    if not _profile_rate or random.random() >= _profile_rate:
+        yield
+        return
+    with _profile_lock:
+        # Só uma amostra por vez: o cProfile não aceita perfis sobrepostos.
+        if _profiling:
+            busy = True
+        else:
+            busy = False
+            _profiling = True
+    if busy:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        with _profile_lock:
+            if _profile_stats is None:
+                _profile_stats = pstats.Stats(profiler)
+            else:
+                _profile_stats.add(profiler)
+            _profiling = False
+
+
+def dump_profile(path: str) -> bool:
+    with _profile_lock:
+        if _profile_stats is None:
+            return False
+        _profile_stats.dump_stats(path)
+        return True
@@ -1,7 +1,10 @@
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, FrozenSet, List, Optional, Tuple
+from functools import lru_cache
 import unicodedata
 import re
 
+from logic.metrics import register_cache, sampled_stage
+
 _menu_options = {
     "1": "marcar_aula_pratica",
     "pratica": "marcar_aula_pratica",
@@ -16,20 +19,145 @@ _menu_options = {
     "cancelar": "finalizar_atendimento",
 }
 
+# Palavras extras reconhecidas dentro de frases ("quero aula teorica") e com
+# erros de digitação ("pratca"). Só as chaves numéricas exigem a mensagem exata.
+# Nada de palavras que aparecem em outras opções: "atendimento" está em
+# "Finalizar atendimento" e transformaria "quero finalizar o atendimento" em
+# duas intenções (fallback).
+_synonyms = {
+    "pratico": "marcar_aula_pratica",
+    "direcao": "marcar_aula_pratica",
+    "volante": "marcar_aula_pratica",
+    "teoria": "marcar_aula_teorica",
+    "teorico": "marcar_aula_teorica",
+    "legislacao": "marcar_aula_teorica",
+    "prova": "link_simulado",
+    "humano": "falar_com_atendente",
+    "encerrar": "finalizar_atendimento",
+    "sair": "finalizar_atendimento",
+}
+
 _saudacoes = {"ola", "olá", "oi", "oie", "menu"}
 
+_PUNCT_RE = re.compile(r"[^\w\s]")
+
+
+@lru_cache(maxsize=4096)
 def _normalize(text: str) -> str:
-    t = text.lower().strip()
-    t = unicodedata.normalize("NFKD", t).encode("ascii", "ignore").decode("ascii")
-    t = re.sub(r"[^\w\s]", " ", t)
-    t = re.sub(r"\s+", " ", t).strip()
-    return t
+    t = text.lower()
+    if not t.isascii():
+        t = unicodedata.normalize("NFKD", t).encode("ascii", "ignore").decode("ascii")
+    return " ".join(_PUNCT_RE.sub(" ", t).split())
+
+
+def _within_distance(a: str, b: str, limit: int) -> bool:
+    # Distância de edição (com transposição) limitada: para cedo quando a
+    # linha inteira da matriz passa do limite.
+    if abs(len(a) - len(b)) > limit:
+        return False
+    # Prefixo e sufixo comuns não mudam a distância: a matriz fica só com o
+    # trecho que difere ("pr[a]tica" x "pr[]tica").
+    first, last_a, last_b = 0, len(a), len(b)
+    while first < last_a and first < last_b and a[first] == b[first]:
+        first += 1
+    while last_a > first and last_b > first and a[last_a - 1] == b[last_b - 1]:
+        last_a -= 1
+        last_b -= 1
+    a, b = a[first:last_a], b[first:last_b]
+    if not a or not b:
+        return len(a) + len(b) <= limit
+    prev2: List[int] = []
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return False
+        prev2, prev = prev, cur
+    return prev[-1] <= limit
+
+
+def _compile() -> Tuple[Dict[str, str], Dict[str, str], Dict[int, List[Tuple[str, FrozenSet[str]]]]]:
+    exact: Dict[str, str] = {}
+    for word in _saudacoes:
+        exact[_normalize(word)] = "saudacao"
+    exact.update(_menu_options)
+
+    keywords = {k: v for k, v in _menu_options.items() if not k.isdigit()}
+    keywords.update(_synonyms)
+    for word in _saudacoes:
+        keywords[_normalize(word)] = "saudacao"
+
+    # Palavras-chave por tamanho, com o conjunto de letras de cada uma.
+    by_length: Dict[int, List[Tuple[str, FrozenSet[str]]]] = {}
+    for word in keywords:
+        if len(word) >= 4:
+            by_length.setdefault(len(word), []).append((word, frozenset(word)))
+    return exact, keywords, by_length
+
+
+_exact_intents, _keyword_intents, _keywords_by_length = _compile()
 
+
+@lru_cache(maxsize=8192)
+def _fuzzy_keyword(word: str) -> Optional[str]:
+    # Cache por palavra: mensagens novas quase sempre repetem palavras.
+    if len(word) < 4:
+        return None
+    # Em palavras curtas, duas edições já viram outra palavra ("direto" x
+    # "direcao").
+    limit = 1 if len(word) < 7 else 2
+    letters = set(word)
+    candidates = []
+    for size in range(len(word) - limit, len(word) + limit + 1):
+        for candidate, candidate_letters in _keywords_by_length.get(size, ()):
+            # Cada edição muda no máximo duas letras do conjunto: fora disso
+            # nem calcula a distância.
+            differ = len(letters ^ candidate_letters)
+            if differ <= 2 * limit:
+                candidates.append((differ, candidate))
+    for _, candidate in sorted(candidates):
+        if _within_distance(word, candidate, limit):
+            return candidate
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _match_text(text: str) -> str:
+    intent = _exact_intents.get(text)
+    if intent is not None:
+        return intent
+
+    found = set()
+    for word in text.split():
+        keyword = word if word in _keyword_intents else _fuzzy_keyword(word)
+        if keyword is not None:
+            found.add(_keyword_intents[keyword])
+
+    # Uma saudação junto com um pedido ("oi, quero aula teorica") vale o pedido.
+    if len(found) > 1:
+        found.discard("saudacao")
+    if len(found) == 1:
+        return found.pop()
+    return "fallback"
+
+
+register_cache("normalize", _normalize)
+register_cache("intent_match", _match_text)
+register_cache("fuzzy_keyword", _fuzzy_keyword)
+
+_timed_normalize = sampled_stage("normalize")(_normalize)
+
+
+@sampled_stage("recognize_intent")
 def recognize_intent(message: str, state: Dict[str, Any]) -> Tuple[str, str]:
-    text = _normalize(message)
+    text = _timed_normalize(message)
     if not text:
         return "fallback", ""
-    words = text.split()
 
     if state and state.get("fluxo") == "agendamento":
         etapa = state.get("etapa")
@@ -38,15 +166,4 @@ def recognize_intent(message: str, state: Dict[str, Any]) -> Tuple[str, str]:
         if etapa == "aguardando_data":
             return "processar_data_agendamento", message.strip()
 
-    if text in _saudacoes:
-        return "saudacao", ""
-    if len(words) == 1 and words[0] in _saudacoes:
-        return "saudacao", ""
-
-    for key, intent in _menu_options.items():
-        if text == key:
-            return intent, ""
-        if len(words) == 1 and words[0] == key:
-            return intent, ""
-
-    return "fallback", ""
+    return _match_text(text), ""
@@ -0,0 +1,341 @@
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: só a trava entre threads.
+    fcntl = None
+
+from logic.messaging import SendError
+from logic.metrics import STAGE_SECONDS, Counter, Gauge
+
+OUTBOX_DEPTH = Gauge("bot_outbox_depth", "Mensagens esperando na fila de saída para o UltraMsg.")
+OUTBOX_RETRIES = Counter("bot_outbox_retries_total", "Novas tentativas de envio depois de uma falha.")
+OUTBOX_DEAD_LETTERS = Counter("bot_outbox_dead_letters_total", "Mensagens desviadas para o arquivo de falhas.", ["reason"])
+
+
+class TokenBucket:
+    """Limita a taxa de envio: `rate` mensagens por segundo, com rajadas de até `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        if rate <= 0:
+            raise ValueError(f"rate deve ser maior que zero (recebido {rate!r})")
+        if burst < 1:
+            raise ValueError(f"burst deve ser pelo menos 1 (recebido {burst!r})")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def _wait_time(self) -> float:
+        # Sem await entre conferir e gastar a ficha: no event loop isso é atômico.
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self) -> None:
+        while True:
+            wait = self._wait_time()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class DeadLetterFile:
+    """Mensagens que não puderam ser entregues, uma linha JSON cada.
+
+    `take()` tira do arquivo as que devem ser reenviadas e deixa as outras
+    (ex.: velhas demais) para inspeção manual.
+
+    Vários workers podem usar o mesmo arquivo: gravações e `take()` travam
+    `<path>.lock` com flock. Sem fcntl (Windows), a trava vale só dentro do
+    processo; use um caminho por worker.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            # Arquivo de trava à parte: o de dados é trocado por os.replace.
+            with open(self.path + ".lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                yield
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        self.append_many([entry])
+
+    def append_many(self, entries: List[Dict[str, Any]]) -> None:
+        lines = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries)
+        with self._locked():
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _read(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # Linha cortada por uma queda no meio da gravação.
+                continue
+        return entries
+
+    def take(self, predicate: Callable[[Dict[str, Any]], bool] = lambda entry: True) -> List[Dict[str, Any]]:
+        with self._locked():
+            entries = self._read()
+            if not entries:
+                return []
+            taken, kept = [], []
+            for entry in entries:
+                (taken if predicate(entry) else kept).append(entry)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(e, ensure_ascii=False) + "\n" for e in kept)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            return taken
+
+    def __len__(self) -> int:
+        with self._locked():
+            return len(self._read())
+
+
+class _Item:
+    __slots__ = ("to", "body", "attempts", "enqueued_at", "dead_lettered")
+
+    def __init__(self, to: str, body: str, attempts: int = 0):
+        self.to = to
+        self.body = body
+        self.attempts = attempts
+        self.dead_lettered = False
+        self.enqueued_at = time.monotonic()
+
+
+class OutboundQueue:
+    """Fila de saída das respostas para o UltraMsg.
+
+    Cada destinatário cai sempre na mesma fila (`workers` filas, uma tarefa
+    cada), então as respostas de um aluno saem na ordem em que foram geradas.
+    Os envios passam pelo TokenBucket, ajustado ao plano do UltraMsg. O limite
+    vale por processo: com N workers, passe `rate` e `burst` já divididos por N.
+    Falhas temporárias são repetidas com espera exponencial e jitter
+    (respeitando o Retry-After). As definitivas, ou depois de `max_attempts`,
+    vão para o arquivo de falhas.
+
+    Com as filas cheias, `send()` espera até `put_timeout`: o webhook demora
+    a responder e o UltraMsg segura as próximas entregas.
+    """
+
+    def __init__(
+        self,
+        sender: Any,
+        rate: float = 5.0,
+        burst: int = 10,
+        max_size: int = 1000,
+        workers: int = 4,
+        max_attempts: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        put_timeout: float = 5.0,
+        dead_letter_path: Optional[str] = "ultramsg.deadletter",
+    ):
+        self.sender = sender
+        self.limiter = TokenBucket(rate, burst)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.put_timeout = put_timeout
+        self.dead_letters = DeadLetterFile(dead_letter_path) if dead_letter_path else None
+        self._workers = workers
+        self._queue_size = max(1, max_size // workers)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._replay: Optional[asyncio.Task] = None
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queues = [asyncio.Queue(self._queue_size) for _ in range(self._workers)]
+        self._tasks = [loop.create_task(self._run(q)) for q in self._queues]
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    async def send(self, to: str, body: str) -> bool:
+        return await self._put(_Item(to, body))
+
+    async def _put(self, item: _Item) -> bool:
+        self._ensure_started()
+        queue = self._queues[hash(item.to) % len(self._queues)]
+        try:
+            await asyncio.wait_for(queue.put(item), self.put_timeout)
+        except asyncio.TimeoutError:
+            await self._dead_letter(item, "full", "fila de saída cheia")
+            return False
+        OUTBOX_DEPTH.inc()
+        return True
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        while True:
+            item = await queue.get()
+            OUTBOX_DEPTH.dec()
+            try:
+                await self._deliver(item)
+            except asyncio.CancelledError:
+                await self._dead_letter(item, "shutdown", "desligado antes do envio")
+                raise
+            except Exception as e:
+                await self._dead_letter(item, "failed", f"{type(e).__name__}: {e}")
+            finally:
+                queue.task_done()
+
+    async def _deliver(self, item: _Item) -> None:
+        while True:
+            await self.limiter.acquire()
+            item.attempts += 1
+            try:
+                await self.sender.send_once(item.to, item.body)
+            except SendError as e:
+                if not e.retryable:
+                    await self._dead_letter(item, "rejected", e.reason)
+                    return
+                if item.attempts >= self.max_attempts:
+                    await self._dead_letter(item, "failed", e.reason)
+                    return
+                # Jitter total: espalha as novas tentativas de vários envios
+                # que falharam juntos.
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (item.attempts - 1)))
+                if e.retry_after is not None:
+                    delay = max(delay, min(e.retry_after, self.max_backoff))
+                OUTBOX_RETRIES.inc()
+                await asyncio.sleep(delay)
+                continue
+            STAGE_SECONDS.observe(time.monotonic() - item.enqueued_at, "outbox_delivery")
+            return
+
+    async def _dead_letter(self, item: _Item, reason: str, error: str) -> None:
+        # Uma vez só por mensagem: um cancelamento no meio da gravação não a
+        # grava de novo como "shutdown".
+        if item.dead_lettered:
+            return
+        item.dead_lettered = True
+        OUTBOX_DEAD_LETTERS.inc(reason)
+        print(f"Mensagem para {item.to} não enviada ({error}).")
+        await self._save_dead_letters([{
+            "to": item.to,
+            "body": item.body,
+            "reason": reason,
+            "error": error,
+            "attempts": item.attempts,
+            "failed_at": time.time(),
+        }])
+
+    async def _save_dead_letters(self, entries: List[Dict[str, Any]]) -> None:
+        # open/fsync/flock fora do event loop: com outro worker segurando a
+        # trava, o loop inteiro pararia. O shield garante que a gravação
+        # termine mesmo se a tarefa for cancelada.
+        if self.dead_letters is None or not entries:
+            return
+        saving = asyncio.get_running_loop().run_in_executor(None, self.dead_letters.append_many, entries)
+        try:
+            await asyncio.shield(saving)
+        except OSError as e:
+            print("Erro ao gravar mensagem no arquivo de falhas:", e)
+
+    async def replay_dead_letters(self, max_age: Optional[float] = 3600.0, include_rejected: bool = False) -> int:
+        """Reenfileira as mensagens do arquivo de falhas; devolve quantas.
+
+        Por padrão, recusas definitivas do UltraMsg e respostas mais velhas que
+        `max_age` segundos ficam no arquivo.
+        """
+        if self.dead_letters is None:
+            return 0
+        now = time.time()
+
+        def wanted(entry: Dict[str, Any]) -> bool:
+            if entry.get("reason") == "rejected" and not include_rejected:
+                return False
+            return max_age is None or now - entry.get("failed_at", 0) <= max_age
+
+        taking = asyncio.get_running_loop().run_in_executor(None, self.dead_letters.take, wanted)
+        taken: List[Dict[str, Any]] = []
+        replayed = i = 0
+        try:
+            taken = await asyncio.shield(taking)
+            for i, entry in enumerate(taken):
+                if await self._put(_Item(entry["to"], entry["body"])):
+                    replayed += 1
+        except asyncio.CancelledError:
+            # Desligando no meio: o que saiu do arquivo e não entrou na fila
+            # volta para ele.
+            if not taken:
+                taken = await taking
+            await self._save_dead_letters(taken[i:])
+            raise
+        return replayed
+
+    def start_replay(self, **kwargs: Any) -> None:
+        """`replay_dead_letters` em segundo plano, para não segurar o boot."""
+        self._replay = asyncio.get_running_loop().create_task(self._run_replay(**kwargs))
+
+    async def _run_replay(self, **kwargs: Any) -> None:
+        try:
+            replayed = await self.replay_dead_letters(**kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("Erro ao reenviar mensagens do arquivo de falhas:", e)
+            return
+        if replayed:
+            print(f"{replayed} mensagens do arquivo de falhas reenfileiradas.")
+
+    async def close(self, timeout: float = 10.0) -> None:
+        # Espera as filas esvaziarem; o que sobrar vai para o arquivo de
+        # falhas e é reenviado no próximo boot.
+        if self._replay is not None:
+            self._replay.cancel()
+            await asyncio.gather(self._replay, return_exceptions=True)
+            self._replay = None
+        if self._loop is not asyncio.get_running_loop():
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for queue in self._queues:
+            while not queue.empty():
+                OUTBOX_DEPTH.dec()
+                await self._dead_letter(queue.get_nowait(), "shutdown", "desligado antes do envio")
+        self._loop = None
+        self._queues = []
+        self._tasks = []
@@ -0,0 +1,356 @@
+from bisect import bisect_left
+from heapq import merge
+from datetime import datetime, time, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import threading
+
+from logic.nlu import _normalize
+
+OPENING_TIME = time(7, 0)
+CLOSING_TIME = time(19, 0)
+SLOT_STEP = timedelta(minutes=60)
+
+DEFAULT_DURATION = timedelta(minutes=50)
+LESSON_DURATIONS = {
+    "prática": timedelta(minutes=50),
+    "teórica": timedelta(minutes=50),
+}
+
+# Recursos disputados por cada tipo de aula e quantos existem de cada um:
+# aula prática ocupa um instrutor (com o carro); aula teórica, uma vaga na sala.
+# Por padrão, uma aula por horário, como antes; os números reais vêm da
+# configuração (`parse_capacities`, RESOURCE_CAPACITIES no app.py).
+RESOURCE_CAPACITIES = {
+    "instrutor": 1,
+    "sala": 1,
+}
+LESSON_RESOURCES = {
+    "prática": "instrutor",
+    "teórica": "sala",
+}
+DEFAULT_RESOURCE = "instrutor"
+
+# Linhas digitadas na planilha vêm como "teorica", "Teórica", "PRATICA"...:
+# a busca é feita pelo tipo normalizado.
+_DURATIONS_BY_KEY = {_normalize(k): v for k, v in LESSON_DURATIONS.items()}
+_RESOURCES_BY_KEY = {_normalize(k): v for k, v in LESSON_RESOURCES.items()}
+
+_EPOCH = datetime(1970, 1, 1)
+_MINUTE = timedelta(minutes=1)
+_DAY_MINUTES = 24 * 60
+_INPUT_FORMATS = ("%d/%m/%Y %H:%M", "%d/%m/%Y %Hh%M", "%d/%m/%Y %Hh", "%d/%m %H:%M")
+
+
+def parse_slot(text: str) -> Optional[datetime]:
+    t = text.strip()
+    if not t:
+        return None
+    try:
+        dt = datetime.fromisoformat(t)
+    except ValueError:
+        dt = None
+        for fmt in _INPUT_FORMATS:
+            try:
+                dt = datetime.strptime(t, fmt)
+                break
+            except ValueError:
+                continue
+        if dt is None:
+            return None
+        if "%Y" not in fmt:
+            dt = dt.replace(year=datetime.now().year)
+    # Horários são sempre no fuso local da autoescola, com precisão de minuto.
+    return dt.replace(tzinfo=None, second=0, microsecond=0)
+
+
+def format_slot(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M")
+
+
+def lesson_duration(tipo: Optional[str]) -> timedelta:
+    return _DURATIONS_BY_KEY.get(_normalize(tipo or ""), DEFAULT_DURATION)
+
+
+def lesson_resource(tipo: Optional[str]) -> str:
+    return _RESOURCES_BY_KEY.get(_normalize(tipo or ""), DEFAULT_RESOURCE)
+
+
+def parse_capacities(text: Optional[str]) -> Dict[str, int]:
+    # "instrutor=3,sala=20" -> {"instrutor": 3, "sala": 20}; recursos não
+    # citados ficam com o padrão de RESOURCE_CAPACITIES.
+    capacities = dict(RESOURCE_CAPACITIES)
+    for item in (text or "").split(","):
+        if not item.strip():
+            continue
+        resource, sep, number = item.partition("=")
+        if not sep or not number.strip().isdigit() or int(number) < 1:
+            raise ValueError(f"capacidade inválida: {item.strip()!r} (use recurso=N, N >= 1)")
+        capacities[resource.strip()] = int(number)
+    return capacities
+
+
+def format_unit(resource: str, lane: int) -> str:
+    return f"{resource}-{lane + 1}"
+
+
+def parse_unit(label: Optional[str]) -> Optional[Tuple[str, int]]:
+    # "instrutor-2" -> ("instrutor", 1). Linhas antigas não têm essa coluna.
+    if not label:
+        return None
+    resource, _, number = label.strip().rpartition("-")
+    if not resource or not number.isdigit() or int(number) < 1:
+        return None
+    return resource, int(number) - 1
+
+
+def within_opening_hours(start: datetime, duration: timedelta) -> bool:
+    end = start + duration
+    return (
+        start.time() >= OPENING_TIME
+        and end.date() == start.date()
+        and end.time() <= CLOSING_TIME
+    )
+
+
+def to_minutes(dt: datetime) -> int:
+    return (dt - _EPOCH) // _MINUTE
+
+
+def from_minutes(minutes: int) -> datetime:
+    return _EPOCH + minutes * _MINUTE
+
+
+class _DayIntervals:
+    # Intervalos [início, fim) de um dia, disjuntos e ordenados; como não se
+    # sobrepõem, os fins também ficam ordenados e uma busca binária basta.
+    __slots__ = ("starts", "ends")
+
+    def __init__(self):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+
+    def conflicts(self, start: int, end: int) -> bool:
+        i = bisect_left(self.starts, end)
+        return i > 0 and self.ends[i - 1] > start
+
+    def insert(self, start: int, end: int) -> None:
+        i = bisect_left(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+
+    def holds(self, start: int, end: int) -> bool:
+        i = bisect_left(self.starts, start)
+        return i < len(self.starts) and self.starts[i] == start and self.ends[i] == end
+
+    def remove(self, start: int) -> bool:
+        i = bisect_left(self.starts, start)
+        if i < len(self.starts) and self.starts[i] == start:
+            del self.starts[i]
+            del self.ends[i]
+            return True
+        return False
+
+    def between(self, start: int, end: int) -> List[int]:
+        return self.starts[bisect_left(self.starts, start):bisect_left(self.starts, end)]
+
+
+class SlotIndex:
+    """Índice de aulas por recurso e intervalo de tempo, particionado por dia.
+
+    Cada unidade de um recurso (instrutor 1, 2, 3...; vaga 1..N da sala) é uma
+    "raia" com intervalos disjuntos, onde conflitos saem em O(log n) por busca
+    binária. Uma reserva ocupa a primeira raia livre, então nunca há mais
+    aulas simultâneas do que a capacidade do recurso.
+
+    `_counts[(início, recurso)]` conta as aulas que começam em cada horário:
+    o caso comum (horário já lotado) é recusado em O(1), sem olhar as raias.
+    Cada (recurso, dia) tem a sua trava.
+
+    Carregar a mesma aula de novo (releitura da planilha, snapshot + diário)
+    não ocupa outra unidade: a aula é reconhecida pela unidade gravada na
+    linha ou, nas linhas antigas sem unidade, pela `source` (número da linha).
+    """
+
+    _STRIPES = 64
+
+    def __init__(self, capacities: Optional[Dict[str, int]] = None):
+        self.capacities = dict(capacities or RESOURCE_CAPACITIES)
+        # Chave: (recurso, dia desde a época); valor: uma raia por unidade.
+        self._days: Dict[Tuple[str, int], List[_DayIntervals]] = {}
+        self._counts: Dict[Tuple[int, str], int] = {}
+        # source -> (recurso, raia, início) da aula que ela ocupou.
+        self._sources: Dict[str, Tuple[str, int, int]] = {}
+        self._day_locks = [threading.Lock() for _ in range(self._STRIPES)]
+        self._lock = threading.Lock()
+
+    def capacity(self, resource: str) -> int:
+        return self.capacities.get(resource, 1)
+
+    def _day_lock(self, key: Tuple[str, int]) -> threading.Lock:
+        return self._day_locks[hash(key) % self._STRIPES]
+
+    def _lanes(self, key: Tuple[str, int], create: bool = False) -> Optional[List[_DayIntervals]]:
+        lanes = self._days.get(key)
+        if lanes is None and create:
+            with self._lock:
+                lanes = self._days.setdefault(key, [_DayIntervals() for _ in range(self.capacity(key[0]))])
+        return lanes
+
+    def _reserve_minutes(self, s: int, e: int, resource: str, lane: Optional[int] = None, known: bool = False) -> Optional[str]:
+        # `known`: a aula veio da planilha/snapshot/diário e pode já estar no
+        # índice na mesma raia; nesse caso não é reservada de novo (devolve None).
+        if self._counts.get((s, resource), 0) >= self.capacity(resource):
+            return None
+        key = (resource, s // _DAY_MINUTES)
+        lanes = self._lanes(key, create=True)
+        with self._day_lock(key):
+            if known and lane is not None and lane < len(lanes) and lanes[lane].holds(s, e):
+                return None
+            # A raia gravada na planilha tem preferência; se não couber (ou não
+            # existir mais), vale a primeira livre.
+            order = range(len(lanes))
+            if lane is not None and lane < len(lanes):
+                order = [lane] + [i for i in order if i != lane]
+            for i in order:
+                if not lanes[i].conflicts(s, e):
+                    lanes[i].insert(s, e)
+                    with self._lock:
+                        self._counts[(s, resource)] = self._counts.get((s, resource), 0) + 1
+                    return format_unit(resource, i)
+        return None
+
+    def remaining(self, start: datetime, duration: timedelta, resource: str = DEFAULT_RESOURCE) -> int:
+        s = to_minutes(start)
+        e = s + duration // _MINUTE
+        capacity = self.capacity(resource)
+        if self._counts.get((s, resource), 0) >= capacity:
+            return 0
+        key = (resource, s // _DAY_MINUTES)
+        lanes = self._lanes(key)
+        if lanes is None:
+            return capacity
+        with self._day_lock(key):
+            return sum(1 for lane in lanes if not lane.conflicts(s, e))
+
+    def is_free(self, start: datetime, duration: timedelta, resource: str = DEFAULT_RESOURCE) -> bool:
+        return self.remaining(start, duration, resource) > 0
+
+    def reserve(self, start: datetime, duration: timedelta, resource: str = DEFAULT_RESOURCE, unit: Optional[str] = None) -> Optional[str]:
+        s = to_minutes(start)
+        parsed = parse_unit(unit)
+        lane = parsed[1] if parsed and parsed[0] == resource else None
+        return self._reserve_minutes(s, s + duration // _MINUTE, resource, lane)
+
+    def discard(self, start: datetime, resource: str = DEFAULT_RESOURCE, unit: Optional[str] = None) -> None:
+        s = to_minutes(start)
+        key = (resource, s // _DAY_MINUTES)
+        lanes = self._lanes(key)
+        if lanes is None:
+            return
+        parsed = parse_unit(unit)
+        with self._day_lock(key):
+            order = [parsed[1]] if parsed and parsed[1] < len(lanes) else range(len(lanes))
+            for i in order:
+                if lanes[i].remove(s):
+                    with self._lock:
+                        self._counts[(s, resource)] -= 1
+                    return
+
+    def _load(self, s: int, e: int, resource: str, lane: Optional[int], source: Optional[str] = None) -> bool:
+        if source is not None and source in self._sources:
+            return False
+        unit = self._reserve_minutes(s, e, resource, lane, known=True)
+        if unit and source is not None:
+            with self._lock:
+                self._sources[source] = (resource, parse_unit(unit)[1], s)
+        return unit is not None
+
+    def add_many(self, items: Iterable[Tuple[datetime, timedelta, str, Optional[str], Optional[str]]]) -> int:
+        # Itens: (início, duração, recurso, unidade, source). Aulas já
+        # presentes e linhas além da capacidade (duplicatas na planilha) são
+        # ignoradas; devolve quantas entraram.
+        added = 0
+        for start, duration, resource, unit, source in items:
+            s = to_minutes(start)
+            parsed = parse_unit(unit)
+            lane = parsed[1] if parsed and parsed[0] == resource else None
+            added += self._load(s, s + duration // _MINUTE, resource, lane, source)
+        return added
+
+    def dump_intervals(self) -> List[Tuple[int, int, str, int, Optional[str]]]:
+        # Itens: (início, fim, recurso, raia, source). A source vai junto para
+        # que as linhas antigas continuem reconhecidas depois do snapshot.
+        with self._lock:
+            keys = sorted(self._days)
+            by_lesson = {lesson: source for source, lesson in self._sources.items()}
+        result = []
+        for key in keys:
+            with self._day_lock(key):
+                for i, lane in enumerate(self._days[key]):
+                    result.extend((s, e, key[0], i, by_lesson.get((key[0], i, s))) for s, e in zip(lane.starts, lane.ends))
+        return result
+
+    def load_intervals(self, items: Iterable[Tuple[int, int, str, int, Optional[str]]]) -> int:
+        return sum(1 for s, e, resource, lane, source in items if self._load(s, e, resource, lane, source))
+
+    def _starts(self, s: Optional[int] = None, e: Optional[int] = None) -> List[int]:
+        # Dia a dia, junta as raias (já ordenadas) de todos os recursos com um
+        # merge; só a lista de dias é ordenada.
+        with self._lock:
+            by_day: Dict[int, List[Tuple[str, int]]] = {}
+            for key in self._days:
+                if s is None or s // _DAY_MINUTES <= key[1] <= e // _DAY_MINUTES:
+                    by_day.setdefault(key[1], []).append(key)
+        result: List[int] = []
+        for day in sorted(by_day):
+            runs = []
+            for key in by_day[day]:
+                with self._day_lock(key):
+                    for lane in self._days[key]:
+                        runs.append(lane.between(s, e) if s is not None else list(lane.starts))
+            result.extend(merge(*runs))
+        return result
+
+    def between(self, start: datetime, end: datetime) -> List[str]:
+        return [format_slot(from_minutes(m)) for m in self._starts(to_minutes(start), to_minutes(end))]
+
+    def all(self) -> List[str]:
+        return [format_slot(from_minutes(m)) for m in self._starts()]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._days.clear()
+            self._counts.clear()
+            self._sources.clear()
+
+
+def _ceil_to_step(dt: datetime) -> datetime:
+    opening = datetime.combine(dt.date(), OPENING_TIME)
+    if dt <= opening:
+        return opening
+    steps = -((opening - dt) // SLOT_STEP)
+    return opening + steps * SLOT_STEP
+
+
+def next_free_slots(
+    index: Any,
+    after: datetime,
+    count: int = 3,
+    duration: timedelta = DEFAULT_DURATION,
+    resource: str = DEFAULT_RESOURCE,
+    max_days: int = 60,
+) -> List[str]:
+    found: List[str] = []
+    # Nunca sugere horários que já passaram.
+    after = max(after, datetime.now())
+    candidate = _ceil_to_step(after)
+    last_day = after.date() + timedelta(days=max_days)
+
+    while len(found) < count and candidate.date() <= last_day:
+        if not within_opening_hours(candidate, duration):
+            candidate = datetime.combine(candidate.date() + timedelta(days=1), OPENING_TIME)
+            continue
+        if index.is_free(candidate, duration, resource):
+            found.append(format_slot(candidate))
+        candidate += SLOT_STEP
+    return found
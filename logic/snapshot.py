@@ -0,0 +1,137 @@
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+# Formato (little-endian):
+#   MAGIC | crc32(corpo) u32 | corpo
+#   corpo = linhas_lidas u64 | n_aulas u32 | len(chave) u16 | chave
+#           | len(última_linha) u16 | última_linha
+#           | len(recursos) u16 | recursos (nomes separados por "\n")
+#           | len(sources) u32 | sources (separadas por "\n")
+#           | n_aulas * (início i32, fim i32, recurso i32, raia i32, source i32)
+# Início e fim em minutos desde 1970-01-01 (hora local da autoescola); recurso
+# e source são posições nas listas de nomes (source -1: aula sem source, ou
+# seja, linha com a unidade gravada). Snapshots do formato anterior, sem
+# source, são descartados e a planilha é relida inteira.
+MAGIC = b"AGSNAP03"
+_HEADER = struct.Struct("<QIH")
+_LEN = struct.Struct("<H")
+_LEN32 = struct.Struct("<I")
+_CRC = struct.Struct("<I")
+_FIELDS = 5
+
+
+class Snapshot(NamedTuple):
+    rows_read: int
+    last_row: str
+    intervals: List[Tuple[int, int, str, int, Optional[str]]]
+
+
+def save_snapshot(
+    path: str, key: str, rows_read: int, last_row: str, intervals: Iterable[Tuple[int, int, str, int, Optional[str]]]
+) -> None:
+    resources: Dict[str, int] = {}
+    sources: Dict[str, int] = {}
+    flat = array("i")
+    for start, end, resource, lane, source in intervals:
+        source_id = -1 if source is None else sources.setdefault(source, len(sources))
+        flat.extend((start, end, resources.setdefault(resource, len(resources)), lane, source_id))
+    if sys.byteorder != "little":
+        flat.byteswap()
+
+    key_b = key.encode("utf-8")
+    last_b = last_row.encode("utf-8")[:65535]
+    names_b = "\n".join(resources).encode("utf-8")
+    sources_b = "\n".join(sources).encode("utf-8")
+    body = b"".join([
+        _HEADER.pack(rows_read, len(flat) // _FIELDS, len(key_b)),
+        key_b,
+        _LEN.pack(len(last_b)),
+        last_b,
+        _LEN.pack(len(names_b)),
+        names_b,
+        _LEN32.pack(len(sources_b)),
+        sources_b,
+        flat.tobytes(),
+    ])
+
+    # Grava num temporário e troca de nome: quem lê vê o arquivo antigo ou o
+    # novo inteiro, nunca um pela metade.
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(_CRC.pack(zlib.crc32(body)))
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    try:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def load_snapshot(path: str, key: str) -> Optional[Snapshot]:
+    """Lê o snapshot; None se não existir, for de outra planilha ou estiver corrompido."""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if size < len(MAGIC) + _CRC.size + _HEADER.size:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(MAGIC)] != MAGIC:
+                return None
+            body_start = len(MAGIC) + _CRC.size
+            (crc,) = _CRC.unpack_from(mm, len(MAGIC))
+            if zlib.crc32(mm[body_start:]) != crc:
+                return None
+
+            pos = body_start
+            rows_read, count, key_len = _HEADER.unpack_from(mm, pos)
+            pos += _HEADER.size
+            if mm[pos:pos + key_len].decode("utf-8") != key:
+                return None
+            pos += key_len
+            (last_len,) = _LEN.unpack_from(mm, pos)
+            pos += _LEN.size
+            last_row = mm[pos:pos + last_len].decode("utf-8")
+            pos += last_len
+            (names_len,) = _LEN.unpack_from(mm, pos)
+            pos += _LEN.size
+            names = mm[pos:pos + names_len].decode("utf-8").split("\n")
+            pos += names_len
+            (sources_len,) = _LEN32.unpack_from(mm, pos)
+            pos += _LEN32.size
+            sources = mm[pos:pos + sources_len].decode("utf-8").split("\n") if sources_len else []
+            pos += sources_len
+
+            flat = array("i")
+            flat.frombytes(mm[pos:pos + count * 4 * _FIELDS])
+    if sys.byteorder != "little":
+        flat.byteswap()
+    if (
+        len(flat) != count * _FIELDS
+        or any(r >= len(names) for r in flat[2::_FIELDS])
+        or any(src >= len(sources) for src in flat[4::_FIELDS])
+    ):
+        return None
+    columns = [flat[i::_FIELDS] for i in range(_FIELDS)]
+    return Snapshot(
+        rows_read,
+        last_row,
+        [(s, e, names[r], lane, sources[src] if src >= 0 else None) for s, e, r, lane, src in zip(*columns)],
+    )
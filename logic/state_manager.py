@@ -1,13 +1,187 @@
-from typing import Dict, Any
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from typing import Dict, Any, List, Optional, Union
+import threading
+import time
 
-_user_states: Dict[str, Dict[str, Any]] = {}
+from logic.metrics import register_collector
 
-def set_state(user_id: str, state: Dict[str, Any]) -> None:
-    _user_states[user_id] = state
 
-def get_state(user_id: str) -> Dict[str, Any]:
-    return _user_states.get(user_id, {"fluxo": "menu"})
+@dataclass(slots=True)
+class SessionState:
+    fluxo: str = "menu"
+    etapa: Optional[str] = None
+    tipo_aula: Optional[str] = None
+    nome: Optional[str] = None
+
+    # Mantém a interface de dict usada pelas ações (`state.get`, `state[...]`).
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default) if key in _FIELDS else default
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in _FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in _FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in _FIELDS
+
+    def copy(self) -> "SessionState":
+        return SessionState(self.fluxo, self.etapa, self.tipo_aula, self.nome)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in _FIELDS}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SessionState":
+        return cls(**{k: v for k, v in data.items() if k in _FIELDS})
+
+
+_FIELDS = tuple(f.name for f in fields(SessionState))
+
+
+class _Entry:
+    __slots__ = ("state", "last_seen")
+
+    def __init__(self, state: SessionState, last_seen: float):
+        self.state = state
+        self.last_seen = last_seen
+
+
+class SessionStore:
+    """Sessões em memória com expiração por inatividade e limite de tamanho (LRU).
+
+    As entradas ficam em ordem de último acesso, então tanto a expiração
+    quanto o despejo por tamanho só olham o começo da fila.
+    """
+
+    def __init__(self, ttl: float = 1800.0, max_size: int = 10000, sweep_interval: float = 60.0):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sweep_interval = sweep_interval
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.expired = 0
+        self.evicted = 0
+
+    def get(self, user_id: str) -> Optional[SessionState]:
+        now = time.monotonic()
+        with self._lock:
+            self._maybe_sweep(now)
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if now - entry.last_seen > self.ttl:
+                del self._entries[user_id]
+                self.expired += 1
+                return None
+            entry.last_seen = now
+            self._entries.move_to_end(user_id)
+            return entry.state
+
+    def set(self, user_id: str, state: SessionState) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._maybe_sweep(now)
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self._entries[user_id] = _Entry(state, now)
+            else:
+                entry.state = state
+                entry.last_seen = now
+                self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def delete(self, user_id: str) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def _maybe_sweep(self, now: float) -> None:
+        if now - self._last_sweep >= self.sweep_interval:
+            self._sweep(now)
+
+    def _sweep(self, now: float) -> int:
+        self._last_sweep = now
+        removed = 0
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if now - entry.last_seen <= self.ttl:
+                break
+            self._entries.popitem(last=False)
+            removed += 1
+        self.expired += removed
+        return removed
+
+    def sweep(self) -> int:
+        with self._lock:
+            return self._sweep(time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {"sessions": len(self._entries), "expired": self.expired, "evicted": self.evicted}
+
+
+_user_states = SessionStore()
+
+
+def configure_sessions(
+    ttl: float = 1800.0,
+    max_size: int = 10000,
+    sweep_interval: float = 60.0,
+    store: Any = None,
+) -> None:
+    global _user_states
+    # `store` permite trocar o backend (ex.: SqliteSessionStore em logic/backends.py).
+    if store is None:
+        store = SessionStore(ttl=ttl, max_size=max_size, sweep_interval=sweep_interval)
+    _user_states = store
+
+
+def session_stats() -> Dict[str, int]:
+    return _user_states.stats()
+
+
+def _collect_sessions() -> List[str]:
+    stats = _user_states.stats()
+    return [
+        "# HELP bot_sessions Sessões de conversa ativas.",
+        "# TYPE bot_sessions gauge",
+        f"bot_sessions {stats['sessions']}",
+        "# HELP bot_sessions_removed_total Sessões removidas por expiração ou limite de tamanho.",
+        "# TYPE bot_sessions_removed_total counter",
+        f'bot_sessions_removed_total{{reason="expired"}} {stats["expired"]}',
+        f'bot_sessions_removed_total{{reason="evicted"}} {stats["evicted"]}',
+    ]
+
+
+register_collector(_collect_sessions)
+
+
+def set_state(user_id: str, state: Union[SessionState, Dict[str, Any]], copy: bool = True) -> None:
+    # O store guarda uma cópia própria: quem gravou (ex.: os estados fixos de
+    # logic/actions.py, compartilhados entre usuários) pode continuar usando o
+    # objeto, e alterar o estado de um usuário nunca afeta outro. `copy=False`
+    # é para quem acabou de criar o SessionState e não vai mais mexer nele.
+    if isinstance(state, SessionState):
+        if copy:
+            state = state.copy()
+    else:
+        state = SessionState.from_dict(state)
+    _user_states.set(user_id, state)
+
+def get_state(user_id: str) -> SessionState:
+    state = _user_states.get(user_id)
+    return state if state is not None else SessionState()
 
 def clear_state(user_id: str) -> None:
-    if user_id in _user_states:
-        del _user_states[user_id]
\ No newline at end of file
+    _user_states.delete(user_id)
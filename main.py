@@ -1,33 +1,99 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-import requests
+from fastapi.responses import JSONResponse, PlainTextResponse
 from logic.actions import executar_acao
-from logic.integrations import configure_google_sheets
+from logic.integrations import (
+    configure_google_sheets,
+    save_slot_snapshot,
+    sheets_ready,
+    start_sheets_warmup,
+    stop_write_behind,
+    warmup_status,
+)
+from logic.messaging import UltraMsgClient
+from logic.outbox import OutboundQueue
+from logic.backends import SqliteDedupCache, use_sqlite_backend
+from logic.dedup import DedupCache
+from logic.dispatcher import UserDispatcher
+from logic import metrics
 
 ULTRA_INSTANCE = "SEU_INSTANCE"      
 ULTRA_TOKEN = "SEU_TOKEN"             
+# Limite de envios do plano do UltraMsg (mensagens por segundo e rajada). É
+# da instância inteira: com `--workers N`, ponha N em WORKERS.
+ULTRA_RATE = 5.0
+ULTRA_BURST = 10
+WORKERS = 1
+ULTRA_DEAD_LETTER_PATH = "ultramsg.deadletter"
 
 
 GOOGLE_SHEET_ID = "SEU_SHEET_ID_AQUI"
 CREDENTIALS_PATH = "service_account.json"
 
+# Ex: "estado.db" para rodar com `uvicorn main:app --workers N`.
+STATE_DB_PATH = None
+
+# Aulas simultâneas por recurso: instrutores (com carro) e vagas na sala.
+RESOURCE_CAPACITIES = {"instrutor": 1, "sala": 1}
+
+# Fração das mensagens perfiladas com cProfile (0 desliga).
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_OUTPUT = "bot.prof"
+metrics.configure_profiling(PROFILE_SAMPLE_RATE)
+
+shared_state = use_sqlite_backend(STATE_DB_PATH, resource_capacities=RESOURCE_CAPACITIES) if STATE_DB_PATH else {}
+
 try:
     configure_google_sheets(
         credentials_json_path=CREDENTIALS_PATH,
         sheet_id=GOOGLE_SHEET_ID,
         worksheet_name="Agendamentos",
         use_cache=True,
+        background=True,
+        resource_capacities=RESOURCE_CAPACITIES,
+        **shared_state,
     )
-    print("Google Sheets configurado com sucesso!")
+    print("Google Sheets configurado; carregando em segundo plano.")
 except Exception as e:
     print("Erro ao configurar Sheets:", e)
 
-app = FastAPI()
+ultramsg = UltraMsgClient(ULTRA_INSTANCE, ULTRA_TOKEN)
+outbox = OutboundQueue(
+    ultramsg,
+    rate=ULTRA_RATE / WORKERS,
+    burst=max(1, ULTRA_BURST // WORKERS),
+    dead_letter_path=ULTRA_DEAD_LETTER_PATH,
+)
+
+# Com vários workers, os ids das mensagens ficam no SQLite compartilhado.
+if STATE_DB_PATH:
+    processed_messages = SqliteDedupCache(STATE_DB_PATH, ttl=600, max_size=50000)
+else:
+    processed_messages = DedupCache(ttl=600, max_size=50000)
+
+
+def processar_mensagem(message, sender):
+    with metrics.sampled_profile():
+        return executar_acao(message, sender)
+
+
+dispatcher = UserDispatcher(processar_mensagem, max_concurrency=32, max_workers=8)
 
 
-def ultramsg_send(to, msg):
-    url = f"https://api.ultramsg.com/{ULTRA_INSTANCE}/messages/chat"
-    payload = {"token": ULTRA_TOKEN, "to": to, "body": msg}
-    requests.post(url, data=payload)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_sheets_warmup()
+    outbox.start_replay()
+    yield
+    dispatcher.shutdown()
+    await outbox.close()
+    await ultramsg.aclose()
+    stop_write_behind()
+    save_slot_snapshot()
+    metrics.dump_profile(PROFILE_OUTPUT)
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.post("/webhook/whatsapp")
@@ -40,8 +106,35 @@ async def receive_message(request: Request):
     if not sender:
         return {"status": "ignored"}
 
-    resposta = executar_acao(message, sender)
+    # Reentrega do UltraMsg: devolve a resposta já calculada, sem refazer nada.
+    message_id = data.get("id")
+    if message_id:
+        is_new, cached = processed_messages.begin(message_id)
+        if not is_new:
+            return {"status": "duplicate", "msg": cached}
+
+    try:
+        with metrics.timed("webhook"):
+            resposta = await dispatcher.submit(sender, message)
+    except Exception:
+        if message_id:
+            processed_messages.forget(message_id)
+        raise
+
+    if message_id:
+        processed_messages.complete(message_id, resposta)
 
-    ultramsg_send(sender, resposta)
+    if resposta is not None:
+        await outbox.send(sender, resposta)
 
     return {"status": "success", "msg": resposta}
+
+
+@app.get("/ready")
+def ready():
+    return JSONResponse(warmup_status(), status_code=200 if sheets_ready() else 503)
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,172 @@
+# Micro-benchmark do caminho de resposta: `executar_acao` atual (tabela de
+# ações + respostas prontas) x o antigo (cadeia de if/elif, menus montados e
+# dicts de estado novos a cada mensagem).
+#
+#   python -m tools.bench_actions
+#
+# Mede o tempo de CPU por mensagem (timeit) e, com tracemalloc, o pico de
+# memória alocada ao longo das conversas (objetos temporários de cada
+# resposta). Sessões e agenda ficam em memória, sem Sheets.
+from datetime import datetime
+import timeit
+import tracemalloc
+
+from logic import actions, integrations
+from logic.integrations import calendar_api_book_slot, calendar_api_next_free_slots
+from logic.metrics import timed
+from logic.nlu import recognize_intent
+from logic.slots import parse_slot
+from logic.state_manager import clear_state, get_state, set_state
+
+# Uma conversa completa, com mensagens fora do roteiro no meio. O horário fica
+# no ano que vem: horários passados são recusados.
+HORARIO = f"{datetime.now().year + 1}-03-03T10:00"
+CONVERSA = ["oi", "xyz", "1", "Maria Souza", HORARIO, "oi", "3", "oi", "4", "oi", "2", "José", "amanhã", HORARIO, "5"]
+
+
+def _legacy_saudacao(user_id):
+    state = {"fluxo": "menu", "etapa": "aguardando_opcao", "tipo_aula": None}
+    set_state(user_id, state)
+    return (
+        "Olá! Eu sou seu assistente virtual da autoescola Brasília\n"
+        "Como posso te ajudar hoje?\n\n"
+        "1️⃣ - Marcar aula prática\n"
+        "2️⃣ - Marcar aula teórica\n"
+        "3️⃣ - Fazer simulado teórico (link do Detran)\n"
+        "4️⃣ - Falar com um atendente humano\n"
+        "5️⃣ - Finalizar atendimento"
+    )
+
+
+def _legacy_fallback(user_id):
+    return (
+        "Desculpe, não entendi o que você quis dizer 😅\n"
+        "Mas posso te ajudar com as seguintes opções:\n\n"
+        "1️⃣ - Marcar aula prática\n"
+        "2️⃣ - Marcar aula teórica\n"
+        "3️⃣ - Fazer simulado teórico (link do Detran)\n"
+        "4️⃣ - Falar com um atendente humano\n"
+        "5️⃣ - Finalizar atendimento"
+    )
+
+
+def _legacy_iniciar(user_id, tipo_aula):
+    state = {"fluxo": "agendamento", "etapa": "aguardando_nome", "tipo_aula": tipo_aula}
+    set_state(user_id, state)
+    return f"Perfeito! Vamos marcar sua aula {tipo_aula}. Qual seu nome completo?"
+
+
+def _legacy_nome(user_id, nome_completo):
+    state = get_state(user_id)
+    state["nome"] = nome_completo.strip()
+    state["etapa"] = "aguardando_data"
+    set_state(user_id, state)
+    primeiro_nome = nome_completo.strip().split()[0]
+    return f"Ótimo, {primeiro_nome}! Qual data e horário (ex: YYYY-MM-DDTHH:MM) você gostaria de agendar?"
+
+
+def _legacy_data(user_id, data_hora):
+    state = get_state(user_id)
+    tipo_aula = state.get("tipo_aula")
+    if parse_slot(data_hora) is None:
+        return "Não entendi a data. Envie no formato YYYY-MM-DDTHH:MM (ex: 2025-03-01T10:00)."
+    result = calendar_api_book_slot({
+        "nome": state.get("nome"),
+        "tipo": tipo_aula,
+        "slot": data_hora.strip(),
+        "user_id": user_id
+    })
+    slot = result["slot"]
+    if result["status"] == "booked":
+        clear_state(user_id)
+        return f"Aula agendada com sucesso para {slot}!"
+    elif result["status"] == "conflict":
+        livres = calendar_api_next_free_slots(slot, count=3, tipo=tipo_aula)
+        if not livres:
+            return f"O horário {slot} não está disponível. Tente outro."
+        opcoes = "\n".join(f"- {h}" for h in livres)
+        return (
+            f"O horário {slot} não está disponível. Horários livres mais próximos:\n"
+            f"{opcoes}\n"
+            "Responda com um deles ou envie outro horário."
+        )
+    elif result["status"] == "invalid":
+        return f"O horário {slot} não pode ser agendado ({result['reason']}). Tente outro."
+    elif result["status"] == "unavailable":
+        return "Nossa agenda ainda está carregando. Envie o horário de novo em alguns segundos, por favor."
+    return "Ocorreu um erro ao tentar agendar."
+
+
+def legacy_executar_acao(message: str, user_id: str) -> str:
+    with timed("state_lookup"):
+        state = get_state(user_id)
+    intent, extra_data = recognize_intent(message, state)
+    if intent == "marcar_aula_pratica":
+        return _legacy_iniciar(user_id, "prática")
+    elif intent == "marcar_aula_teorica":
+        return _legacy_iniciar(user_id, "teórica")
+    elif intent == "link_simulado":
+        clear_state(user_id)
+        return "Aqui está o link para o simulado: https://www.detran.sp.gov.br/simulado"
+    elif intent == "falar_com_atendente":
+        clear_state(user_id)
+        return "Certo, entre em contato com nosso atendente pelo telefone: (44) 99999-9999."
+    elif intent == "finalizar_atendimento":
+        clear_state(user_id)
+        return "Tudo bem! Atendimento finalizado."
+    elif intent == "saudacao":
+        return _legacy_saudacao(user_id)
+    elif intent == "processar_nome_agendamento":
+        return _legacy_nome(user_id, extra_data)
+    elif intent == "processar_data_agendamento":
+        return _legacy_data(user_id, extra_data)
+    return _legacy_fallback(user_id)
+
+
+def _conversa(fn) -> None:
+    # A agenda é zerada a cada rodada para a reserva sempre dar certo.
+    integrations.reset_bookings()
+    for message in CONVERSA:
+        fn(message, "bench-user")
+
+
+def _cpu(fn, number: int) -> float:
+    best = min(timeit.repeat(lambda: _conversa(fn), number=number, repeat=5))
+    return best / (number * len(CONVERSA)) * 1e6
+
+
+def _pico(fn, rounds: int) -> int:
+    _conversa(fn)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for _ in range(rounds):
+        _conversa(fn)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return peak
+
+
+def main() -> None:
+    # Confere que as duas versões respondem igual antes de medir.
+    # Agenda zerada antes de cada versão: as duas reservam o mesmo horário.
+    for message in CONVERSA:
+        integrations.reset_bookings()
+        old = legacy_executar_acao(message, "check-a")
+        integrations.reset_bookings()
+        new = actions.executar_acao(message, "check-b")
+        if old != new:
+            raise SystemExit(f"Respostas divergem para {message!r}:\n{old!r}\n{new!r}")
+
+    number = 2000
+    legacy = _cpu(legacy_executar_acao, number)
+    current = _cpu(actions.executar_acao, number)
+    legacy_peak = _pico(legacy_executar_acao, 200)
+    current_peak = _pico(actions.executar_acao, 200)
+
+    print(f"{'':10} {'us/mensagem':>12} {'pico (bytes)':>13}")
+    print(f"{'antigo':10} {legacy:12.2f} {legacy_peak:13d}")
+    print(f"{'atual':10} {current:12.2f} {current_peak:13d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Micro-benchmark do reconhecimento de intenções: matcher atual x o antigo
+# (normalização sem cache + varredura linear de `_menu_options`).
+#
+#   python -m tools.bench_nlu
+#   python -m tools.bench_nlu --unique 20000
+#
+# As mensagens curtas de MESSAGES se repetem e ficam no cache; o fluxo de
+# mensagens únicas (frases de 4 palavras sorteadas de VOCABULARIO, com os
+# caches vazios no começo) mede o custo real de mensagens novas.
+from typing import List
+import argparse
+import random
+import re
+import time
+import timeit
+import unicodedata
+
+from logic import nlu
+
+MESSAGES = [
+    "1", "2", "oi", "Olá!", "menu", "pratica", "Teórica", "simulado", "5",
+    "pratca", "quero aula teorica", "atendete", "bom dia", "xyz",
+]
+
+VOCABULARIO = (
+    "quero marcar uma aula amanhã de manhã por favor bom dia boa tarde noite como faço para agendar "
+    "minha carteira habilitação preciso falar sobre horário semana que vem sexta segunda terça obrigado "
+    "valeu tudo bem instrutor carro moto categoria exame detran renovar documento pagamento pix valor "
+    "quanto custa onde fica endereço prática teórica simulado atendente direto pratca teorca"
+).split()
+
+
+def unique_messages(count: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    messages = {}
+    while len(messages) < count:
+        text = " ".join(rng.choice(VOCABULARIO) for _ in range(4))
+        messages[text] = None
+    return list(messages)
+
+
+def _clear_caches() -> None:
+    nlu._normalize.cache_clear()
+    nlu._match_text.cache_clear()
+    nlu._fuzzy_keyword.cache_clear()
+
+
+def _legacy_normalize(text: str) -> str:
+    t = text.lower().strip()
+    t = unicodedata.normalize("NFKD", t).encode("ascii", "ignore").decode("ascii")
+    t = re.sub(r"[^\w\s]", " ", t)
+    t = re.sub(r"\s+", " ", t).strip()
+    return t
+
+
+def legacy_recognize_intent(message: str, state: dict):
+    text = _legacy_normalize(message)
+    if not text:
+        return "fallback", ""
+    words = text.split()
+    if text in nlu._saudacoes:
+        return "saudacao", ""
+    if len(words) == 1 and words[0] in nlu._saudacoes:
+        return "saudacao", ""
+    for key, intent in nlu._menu_options.items():
+        if text == key:
+            return intent, ""
+        if len(words) == 1 and words[0] == key:
+            return intent, ""
+    return "fallback", ""
+
+
+def _bench(fn, number: int) -> float:
+    state = {"fluxo": "menu"}
+
+    def loop():
+        for m in MESSAGES:
+            fn(m, state)
+
+    best = min(timeit.repeat(loop, number=number, repeat=5))
+    return best / (number * len(MESSAGES)) * 1e6
+
+
+def _stream(fn, messages: List[str]) -> float:
+    state = {"fluxo": "menu"}
+    best = float("inf")
+    for _ in range(3):
+        _clear_caches()
+        start = time.perf_counter()
+        for m in messages:
+            fn(m, state)
+        best = min(best, time.perf_counter() - start)
+    return best / len(messages) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--unique", type=int, default=5000, help="tamanho do fluxo de mensagens únicas")
+    args = parser.parse_args()
+
+    number = 2000
+    legacy = _bench(legacy_recognize_intent, number)
+    current = _bench(nlu.recognize_intent, number)
+    _clear_caches()
+    cold = _bench(lambda m, s: (_clear_caches(), nlu.recognize_intent(m, s)), 200)
+
+    messages = unique_messages(args.unique)
+    legacy_stream = _stream(legacy_recognize_intent, messages)
+    current_stream = _stream(nlu.recognize_intent, messages)
+
+    print(f"antigo:            {legacy:6.2f} us/mensagem")
+    print(f"atual (cache):     {current:6.2f} us/mensagem")
+    print(f"atual (sem cache): {cold:6.2f} us/mensagem")
+    print(f"{len(messages)} mensagens únicas: antigo {legacy_stream:.2f} us/mensagem, atual {current_stream:.2f} us/mensagem")
+
+    recognized_legacy = sum(legacy_recognize_intent(m, {})[0] != "fallback" for m in MESSAGES)
+    recognized = sum(nlu.recognize_intent(m, {})[0] != "fallback" for m in MESSAGES)
+    print(f"reconhecidas: antigo {recognized_legacy}/{len(MESSAGES)}, atual {recognized}/{len(MESSAGES)}")
+
+
+if __name__ == "__main__":
+    main()
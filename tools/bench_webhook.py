@@ -0,0 +1,308 @@
+# Teste de carga do /webhook/whatsapp (app.py e main.py) com conversas
+# sintéticas geradas a partir de payloads gravados do UltraMsg.
+#
+#   python -m tools.bench_webhook                      # compara com a linha de base
+#   python -m tools.bench_webhook --save-baseline      # grava uma nova linha de base
+#   python -m tools.bench_webhook --users 1000 --concurrency 100 --sheets-latency 0.05
+#
+# Roda tudo no processo, sem rede: o app é chamado via ASGI, o Google Sheets é
+# o gspread falso (tools/fake_gspread.py) e o UltraMsg é tools/fake_ultramsg.py.
+# Sai com código 1 se a vazão cair ou o p95 de alguma etapa subir além da
+# tolerância em relação à linha de base.
+#
+# Para a comparação valer em outra máquina (ou numa máquina ocupada), a linha
+# de base guarda também o tempo de uma carga fixa de CPU (`calibrate`), e os
+# números dela são escalados pela razão entre as duas medições. Cada alvo roda
+# `--runs` vezes e vale a melhor rodada: só é regressão o que aparece em todas.
+from datetime import datetime
+from typing import Any, Dict, List
+import argparse
+import asyncio
+import copy
+import importlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import timeit
+
+import httpx
+
+from logic.dedup import DedupCache
+from logic.outbox import DeadLetterFile, TokenBucket
+from tools import fake_ultramsg
+from tools.fake_gspread import FakeClient
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PAYLOADS_PATH = os.path.join(HERE, "bench_payloads.jsonl")
+BASELINE_PATH = os.path.join(HERE, "bench_baseline.json")
+
+STAGES = ("fallback", "saudacao", "opcao", "nome", "data")
+NOMES = ["Maria Souza", "João Pedro Lima", "Ana", "Carlos Eduardo", "Fernanda Alves", "José"]
+
+
+def load_payloads(path: str) -> Dict[str, List[Dict[str, Any]]]:
+    by_stage: Dict[str, List[Dict[str, Any]]] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                by_stage.setdefault(entry["stage"], []).append(entry["payload"])
+    return by_stage
+
+
+def _journal_path() -> str:
+    return os.path.join(tempfile.mkdtemp(prefix="bench-webhook-"), "agendamentos.journal")
+
+
+def load_target(name: str):
+    # app.py/main.py configuram o Sheets na importação: troca o cliente real
+    # pelo falso só durante o import.
+    from logic import integrations
+
+    original = integrations.configure_google_sheets
+
+    def configure(**kwargs):
+        kwargs.update(
+            client=FakeClient(),
+            credentials_json_path=None,
+            credentials_json_dict=None,
+            journal_path=_journal_path(),
+            snapshot_path=None,
+        )
+        return original(**kwargs)
+
+    integrations.configure_google_sheets = configure
+    try:
+        module = importlib.import_module(name)
+    finally:
+        integrations.configure_google_sheets = original
+
+    module.ultramsg.base_url = "http://fake-ultramsg"
+    module.ultramsg._transport = httpx.ASGITransport(app=fake_ultramsg.app)
+    # Sem limite de taxa (mede o app, não o plano do UltraMsg) e com o
+    # arquivo de falhas num diretório temporário.
+    module.outbox.limiter = TokenBucket(rate=1e9, burst=10**9)
+    module.outbox.dead_letters = DeadLetterFile(
+        os.path.join(tempfile.mkdtemp(prefix="bench-webhook-"), "ultramsg.deadletter")
+    )
+    return module
+
+
+def reset_state(module, sheets_latency: float, ultramsg_latency: float) -> None:
+    from logic import integrations, state_manager
+
+    # As rodadas repetem os ids das mensagens: sem isso, da segunda em diante
+    # tudo seria descartado como reentrega.
+    dedup = module.processed_messages
+    module.processed_messages = DedupCache(ttl=dedup.ttl, max_size=dedup.max_size)
+
+    integrations.configure_google_sheets(
+        client=FakeClient(latency=sheets_latency, rows=[["nome", "tipo", "slot", "user_id"]]),
+        sheet_id="bench",
+        worksheet_name="Agendamentos",
+        journal_path=_journal_path(),
+        snapshot_path=None,
+    )
+    state_manager.configure_sessions()
+    fake_ultramsg.reset()
+    fake_ultramsg.config["delay"] = ultramsg_latency
+
+
+def _message(template: Dict[str, Any], flat: bool, user: str, seq: int, body: str = None) -> Dict[str, Any]:
+    payload = copy.deepcopy(template)
+    data = payload["data"]
+    data["from"] = user
+    data["id"] = f"false_{user}_{seq:08d}"
+    if body is not None:
+        data["body"] = body
+    # main.py recebe os campos da mensagem no nível de cima do JSON.
+    return data if flat else payload
+
+
+def _random_slot(rng: random.Random) -> str:
+    # Ano que vem: horários passados são recusados.
+    year = datetime.now().year + 1
+    day = rng.randint(1, 20)
+    hour = rng.randint(7, 18)
+    if rng.random() < 0.2:
+        return f"{day:02d}/04/{year} {hour:02d}:00"
+    return f"{year}-04-{day:02d}T{hour:02d}:00"
+
+
+async def run_user(client: httpx.AsyncClient, payloads, flat: bool, index: int, rng: random.Random, latencies) -> None:
+    from logic.state_manager import get_state
+
+    user = f"55619{index:08d}@c.us"
+    seq = 0
+
+    async def send(stage: str, body: str = None) -> None:
+        nonlocal seq
+        seq += 1
+        msg = _message(rng.choice(payloads[stage]), flat, user, seq, body)
+        start = time.perf_counter()
+        resp = await client.post("/webhook/whatsapp", json=msg)
+        latencies[stage].append(time.perf_counter() - start)
+        resp.raise_for_status()
+
+    if rng.random() < 0.2:
+        await send("fallback")
+    await send("saudacao")
+    await send("opcao")
+    await send("nome", rng.choice(NOMES))
+    # Horário ocupado: o aluno tenta outro, como faria no WhatsApp.
+    for _ in range(3):
+        await send("data", _random_slot(rng))
+        if get_state(user).get("etapa") != "aguardando_data":
+            break
+
+
+async def run_target(module, payloads, users: int, concurrency: int, seed: int) -> Dict[str, Any]:
+    latencies: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    rng = random.Random(seed)
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(users):
+        queue.put_nowait(i)
+
+    transport = httpx.ASGITransport(app=module.app)
+    async with module.app.router.lifespan_context(module.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+            async def worker():
+                while not queue.empty():
+                    i = queue.get_nowait()
+                    await run_user(client, payloads, module.__name__ == "main", i, random.Random(rng.random()), latencies)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+
+    total = sum(len(v) for v in latencies.values())
+    return {
+        "requests": total,
+        "delivered": len(fake_ultramsg.sent_messages),
+        "rps": total / elapsed,
+        "stages": {stage: _summary(values) for stage, values in latencies.items() if values},
+    }
+
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": _percentile(values, 50) * 1000,
+        "p95": _percentile(values, 95) * 1000,
+        "p99": _percentile(values, 99) * 1000,
+    }
+
+
+def print_report(name: str, result: Dict[str, Any]) -> None:
+    print(f"\n[{name}] {result['requests']} requisições, {result['rps']:.1f} req/s, {result['delivered']} respostas entregues")
+    print(f"  {'etapa':<10}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, s in result["stages"].items():
+        print(f"  {stage:<10}{s['count']:>7}{s['p50']:>10.2f}{s['p95']:>10.2f}{s['p99']:>10.2f}")
+
+
+def calibrate(payloads) -> float:
+    # O mesmo tipo de trabalho do teste (JSON e cópias de payload), sem o app:
+    # mede quão rápida a máquina está agora.
+    sample = [p for stage in STAGES for p in payloads.get(stage, [])][:20]
+
+    def work():
+        for p in sample:
+            json.loads(json.dumps(copy.deepcopy(p)))
+
+    return min(timeit.repeat(work, number=200, repeat=5))
+
+
+def best_of(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # Mesma semente em todas as rodadas: mesmas etapas e contagens.
+    best = dict(runs[0])
+    best["rps"] = max(r["rps"] for r in runs)
+    best["stages"] = {}
+    for stage, s in runs[0]["stages"].items():
+        best["stages"][stage] = dict(s)
+        for key in ("p50", "p95", "p99"):
+            best["stages"][stage][key] = min(r["stages"][stage][key] for r in runs)
+    return best
+
+
+def check_regressions(name: str, result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, scale: float = 1.0) -> List[str]:
+    # `scale` > 1: a máquina está mais lenta que na linha de base.
+    problems = []
+    expected_rps = baseline["rps"] / scale
+    if result["rps"] < expected_rps * (1 - tolerance):
+        problems.append(f"{name}: vazão {result['rps']:.1f} req/s < linha de base {expected_rps:.1f} (ajustada)")
+    for stage, s in result["stages"].items():
+        base = baseline["stages"].get(stage)
+        if not base:
+            continue
+        expected = base["p95"] * scale
+        # 1 ms de folga absoluta: latências muito pequenas variam demais.
+        if s["p95"] > expected * (1 + tolerance) + 1.0:
+            problems.append(f"{name}/{stage}: p95 {s['p95']:.2f} ms > linha de base {expected:.2f} ms (ajustada)")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", nargs="+", default=["app", "main"], choices=["app", "main"])
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sheets-latency", type=float, default=0.0, help="latência simulada do Google Sheets (s)")
+    parser.add_argument("--ultramsg-latency", type=float, default=0.0, help="latência simulada do UltraMsg (s)")
+    parser.add_argument("--payloads", default=PAYLOADS_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.3)
+    parser.add_argument("--runs", type=int, default=3, help="rodadas por alvo; vale a melhor")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.payloads)
+    results: Dict[str, Any] = {}
+    for name in args.target:
+        module = load_target(name)
+        runs = []
+        for _ in range(max(1, args.runs)):
+            reset_state(module, args.sheets_latency, args.ultramsg_latency)
+            runs.append(asyncio.run(run_target(module, payloads, args.users, args.concurrency, args.seed)))
+        results[name] = best_of(runs)
+        print_report(name, results[name])
+    results["calibration"] = calibrate(payloads)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nLinha de base gravada em {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("\nSem linha de base para comparar (use --save-baseline).")
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    scale = results["calibration"] / baseline["calibration"] if "calibration" in baseline else 1.0
+    print(f"\nCPU em relação à linha de base: {scale:.2f}x o tempo")
+    problems = []
+    for name in args.target:
+        if name in baseline:
+            problems += check_regressions(name, results[name], baseline[name], args.tolerance, scale)
+    if problems:
+        print("\nRegressões:")
+        for p in problems:
+            print("  " + p)
+        sys.exit(1)
+    print("\nSem regressões em relação à linha de base.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Vazão do backend SQLite compartilhado com 1, 2, 4 e 8 processos worker.
+#
+#   python -m tools.bench_workers --workers 1 2 4 8 --conversations 300
+#
+# Cada processo simula o que um worker do uvicorn faz: conversas completas
+# (saudação -> opção -> nome -> data) via `executar_acao`, com sessões e
+# reservas no mesmo arquivo SQLite. Ao final confere que nenhum horário foi
+# confirmado além da capacidade de instrutores.
+from collections import Counter
+from datetime import datetime
+from multiprocessing import Pool
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+def _worker(args):
+    db_path, worker_id, conversations, slots = args
+
+    from logic.actions import executar_acao
+    from logic.backends import use_sqlite_backend
+
+    use_sqlite_backend(db_path)
+    rng = random.Random(worker_id)
+    booked = []
+    messages = 0
+
+    for i in range(conversations):
+        user_id = f"w{worker_id}-u{i}"
+        slot = rng.choice(slots)
+        for text in ("oi", "1", f"Aluno {worker_id} {i}"):
+            executar_acao(text, user_id)
+        reply = executar_acao(slot, user_id)
+        messages += 4
+        if "sucesso" in reply:
+            booked.append(slot)
+
+    return messages, booked
+
+
+def run(workers: int, conversations: int) -> float:
+    db_path = os.path.join(tempfile.mkdtemp(prefix="bench-workers-"), "state.db")
+    # Ano que vem: horários passados são recusados.
+    year = datetime.now().year + 1
+    slots = [f"{year}-03-{d:02d}T{h:02d}:00" for d in range(1, 29) for h in range(7, 19)]
+
+    from logic.backends import SqliteBookingIndex
+    SqliteBookingIndex(db_path).close()
+
+    start = time.perf_counter()
+    with Pool(workers) as pool:
+        results = pool.map(_worker, [(db_path, w, conversations, slots) for w in range(workers)])
+    elapsed = time.perf_counter() - start
+
+    messages = sum(r[0] for r in results)
+    from logic.slots import RESOURCE_CAPACITIES
+
+    booked = [slot for r in results for slot in r[1]]
+    stored = SqliteBookingIndex(db_path).all()
+    if max(Counter(booked).values(), default=0) > RESOURCE_CAPACITIES["instrutor"] or sorted(booked) != stored:
+        sys.exit("Horário confirmado além da capacidade entre workers!")
+
+    return messages / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--conversations", type=int, default=300, help="conversas por worker")
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        rate = run(workers, args.conversations)
+        print(f"{workers:>2} workers: {rate:10.1f} mensagens/s")
+
+
+if __name__ == "__main__":
+    main()
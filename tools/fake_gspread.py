@@ -0,0 +1,78 @@
+# Cliente gspread falso, em memória, para testes e benchmarks locais:
+#
+#   from tools.fake_gspread import FakeClient
+#   configure_google_sheets(client=FakeClient(latency=0.05), sheet_id="fake")
+from typing import Dict, List, Optional
+import re
+import threading
+import time
+
+
+class FakeWorksheet:
+    def __init__(self, title: str, rows: Optional[List[List[str]]] = None, latency: float = 0.0):
+        self.title = title
+        self.rows: List[List[str]] = [list(r) for r in (rows or [])]
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _call(self, name: str) -> None:
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_all_values(self) -> List[List[str]]:
+        self._call("get_all_values")
+        with self._lock:
+            return [list(r) for r in self.rows]
+
+    def get_values(self, range_name: str = "") -> List[List[str]]:
+        self._call("get_values")
+        m = re.match(r"^[A-Z]+(\d+)", range_name)
+        start = int(m.group(1)) - 1 if m else 0
+        with self._lock:
+            return [list(r) for r in self.rows[start:]]
+
+    def append_row(self, values: List[str], value_input_option: str = "RAW") -> None:
+        self._call("append_row")
+        with self._lock:
+            self.rows.append(["" if v is None else str(v) for v in values])
+
+    def append_rows(self, values: List[List[str]], value_input_option: str = "RAW") -> None:
+        self._call("append_rows")
+        with self._lock:
+            for row in values:
+                self.rows.append(["" if v is None else str(v) for v in row])
+
+
+class FakeSpreadsheet:
+    def __init__(self, client: "FakeClient"):
+        self.client = client
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        self.client._call("worksheet")
+        with self.client._lock:
+            if title not in self.client.worksheets:
+                self.client.worksheets[title] = FakeWorksheet(title, latency=self.client.latency)
+            return self.client.worksheets[title]
+
+
+class FakeClient:
+    def __init__(self, latency: float = 0.0, rows: Optional[List[List[str]]] = None, worksheet_name: str = "Agendamentos"):
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.worksheets: Dict[str, FakeWorksheet] = {}
+        if rows is not None:
+            self.worksheets[worksheet_name] = FakeWorksheet(worksheet_name, rows, latency)
+
+    def _call(self, name: str) -> None:
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        self._call("open_by_key")
+        return FakeSpreadsheet(self)
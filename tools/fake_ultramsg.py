@@ -0,0 +1,47 @@
+# Servidor UltraMsg falso para testes locais.
+#
+#   uvicorn tools.fake_ultramsg:app --port 8081
+#   ULTRAMSG_BASE_URL=http://127.0.0.1:8081 uvicorn app:app
+#
+# Também pode ser usado sem rede com `httpx.ASGITransport(app=app)`.
+from typing import Any, Dict, List
+import asyncio
+from urllib.parse import parse_qs
+
+from fastapi import FastAPI, Request, Response
+
+app = FastAPI()
+
+sent_messages: List[Dict[str, Any]] = []
+
+# Controle de falhas: as próximas `fail_next` requisições respondem `fail_status`.
+config = {"fail_next": 0, "fail_status": 503, "delay": 0.0}
+
+
+def reset() -> None:
+    sent_messages.clear()
+    config.update({"fail_next": 0, "fail_status": 503, "delay": 0.0})
+
+
+@app.post("/{instance_id}/messages/chat")
+async def send_chat(instance_id: str, request: Request):
+    if config["delay"]:
+        await asyncio.sleep(config["delay"])
+
+    if config["fail_next"] > 0:
+        config["fail_next"] -= 1
+        return Response(status_code=config["fail_status"])
+
+    form = parse_qs((await request.body()).decode("utf-8"))
+    sent_messages.append({
+        "instance_id": instance_id,
+        "token": form.get("token", [None])[0],
+        "to": form.get("to", [None])[0],
+        "body": form.get("body", [None])[0],
+    })
+    return {"sent": "true", "message": "ok", "id": len(sent_messages)}
+
+
+@app.get("/messages")
+def list_messages():
+    return sent_messages
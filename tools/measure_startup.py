@@ -0,0 +1,82 @@
+# Mede o tempo entre o início do processo e a primeira resposta do app, com
+# a carga do Sheets bloqueando a importação ("eager", comportamento antigo) e
+# em segundo plano ("background", padrão atual).
+#
+#   python -m tools.measure_startup --target app --rows 20000 --latency 0.5
+#
+# Cada medição roda num processo novo, com o gspread falso (a latência
+# simula autenticação e leitura da planilha).
+import argparse
+import json
+import subprocess
+import sys
+
+_CHILD = r"""
+import time
+t0 = time.perf_counter()
+import asyncio, json, os, sys, tempfile
+import httpx
+from logic import integrations
+from tools.fake_gspread import FakeClient
+
+mode, target, rows, latency = sys.argv[1], sys.argv[2], int(sys.argv[3]), float(sys.argv[4])
+original = integrations.configure_google_sheets
+sheet = [["nome", "tipo", "slot", "user_id"]] + [
+    ["Aluno", "prática", f"20{20 + i // 3000:02d}-{i // 250 % 12 + 1:02d}-{i // 10 % 25 + 1:02d}T{7 + i % 10:02d}:00", "u"]
+    for i in range(rows)
+]
+
+def configure(**kwargs):
+    kwargs.update(
+        client=FakeClient(latency=latency, rows=sheet),
+        credentials_json_path=None,
+        journal_path=os.path.join(tempfile.mkdtemp(), "agendamentos.journal"),
+        background=(mode == "background"),
+        snapshot_path=None,
+    )
+    return original(**kwargs)
+
+integrations.configure_google_sheets = configure
+module = __import__(target)
+t_import = time.perf_counter()
+
+async def main():
+    async with module.app.router.lifespan_context(module.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=module.app), base_url="http://x") as c:
+            await c.get("/metrics")
+            t_first = time.perf_counter()
+            while not integrations.sheets_ready():
+                await asyncio.sleep(0.01)
+            t_ready = time.perf_counter()
+    return t_first, t_ready
+
+t_first, t_ready = asyncio.run(main())
+print(json.dumps({"import": t_import - t0, "first_response": t_first - t0, "ready": t_ready - t0}))
+"""
+
+
+def measure(mode: str, target: str, rows: int, latency: float) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD, mode, target, str(rows), str(latency)],
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", default="app", choices=["app", "main"])
+    parser.add_argument("--rows", type=int, default=20000, help="linhas na planilha falsa")
+    parser.add_argument("--latency", type=float, default=0.5, help="latência por chamada ao Sheets (s)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'modo':<12}{'import s':>10}{'1a resposta s':>16}{'pronto s':>10}")
+    for mode in ("eager", "background"):
+        runs = [measure(mode, args.target, args.rows, args.latency) for _ in range(args.repeat)]
+        best = {k: min(r[k] for r in runs) for k in runs[0]}
+        print(f"{mode:<12}{best['import']:>10.3f}{best['first_response']:>16.3f}{best['ready']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# Teste de estresse das reservas concorrentes contra um gspread falso.
+#
+#   python -m tools.stress_booking --workers 1 2 4 8 --latency 0.005
+#
+# Várias threads disputam o mesmo conjunto de horários; o script falha se
+# alguma unidade (instrutor) for reservada duas vezes no mesmo horário, se um
+# horário passar da capacidade ou se uma tentativa for recusada com unidade
+# livre, e mostra a vazão por número de threads.
+#
+# O índice é atualizado pela planilha durante a disputa (`--cache-ttl`), e no
+# fim o processo "cai" e reinicia a partir do snapshot e do diário: em todos
+# os casos cada reserva tem que aparecer no índice exatamente uma vez.
+from collections import Counter
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from logic import integrations
+from logic.slots import lesson_resource
+from tools.fake_gspread import FakeClient
+
+
+def _crash() -> None:
+    # Simula uma queda: o flusher para sem a gravação final e o que estiver
+    # no diário fica para o próximo boot.
+    flusher = integrations._flusher
+    if flusher is not None:
+        flusher._stop.set()
+        flusher._wake.set()
+        flusher._thread.join()
+    integrations._flusher = None
+    integrations._journal = None
+
+
+def _check_index(expected: Counter, when: str) -> None:
+    indexed = Counter(integrations.list_booked_slots())
+    if indexed != expected:
+        extra = sum((indexed - expected).values())
+        missing = sum((expected - indexed).values())
+        sys.exit(f"Índice diverge das reservas {when}: {extra} a mais, {missing} a menos.")
+
+
+def run(workers: int, attempts: int, slots: int, latency: float, write_behind: bool, cache_ttl: float, capacity: int) -> float:
+    client = FakeClient(latency=latency, rows=[["nome", "tipo", "slot", "user_id", "unidade"]])
+    journal_dir = tempfile.mkdtemp(prefix="stress-journal-")
+    config = dict(
+        client=client,
+        sheet_id="stress",
+        worksheet_name="Agendamentos",
+        cache_ttl=cache_ttl,
+        journal_path=os.path.join(journal_dir, "agendamentos.journal") if write_behind else None,
+        flush_interval=0.05,
+        snapshot_path=os.path.join(journal_dir, "agendamentos.snapshot"),
+        resource_capacities={lesson_resource("prática"): capacity},
+    )
+    integrations.configure_google_sheets(**config)
+
+    # Ano que vem: horários passados são recusados.
+    year = datetime.now().year + 1
+    pool = [f"{year}-03-{d:02d}T{h:02d}:00" for d in range(1, 29) for h in range(7, 19)][:slots]
+    rng = random.Random(workers)
+    plan = [rng.choice(pool) for _ in range(attempts)]
+
+    def book(i: int) -> dict:
+        return integrations.calendar_api_book_slot({
+            "nome": f"Aluno {i}",
+            "tipo": "prática",
+            "slot": plan[i],
+            "user_id": f"user-{i}",
+        })
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        results = list(ex.map(book, range(attempts)))
+    elapsed = time.perf_counter() - start
+    integrations.flush_bookings()
+    time.sleep(cache_ttl)
+    _check_index(Counter(r["slot"] for r in results if r["status"] == "booked"), "depois de reler a planilha")
+
+    # Reservas ainda no diário entram no snapshot; depois da queda, o
+    # diário é reenviado e a planilha relida por cima do snapshot.
+    integrations.save_slot_snapshot()
+    _crash()
+    integrations.configure_google_sheets(**config)
+    integrations.flush_bookings()
+    time.sleep(cache_ttl)
+    integrations.stop_write_behind()
+
+    booked = [(r["slot"], r["unit"]) for r in results if r["status"] == "booked"]
+    errors = [r for r in results if r["status"] == "error"]
+    rows = [(r[2], r[4]) for r in client.worksheets["Agendamentos"].rows[1:]]
+    per_slot = Counter(slot for slot, _ in booked)
+    expected = {slot: min(n, capacity) for slot, n in Counter(plan).items()}
+
+    if errors:
+        sys.exit(f"{len(errors)} reservas com erro: {errors[0]}")
+    if len(booked) != len(set(booked)) or len(rows) != len(set(rows)):
+        sys.exit("Reserva duplicada detectada!")
+    if per_slot != expected:
+        sys.exit("Capacidade dos horários não confere com as tentativas!")
+    if sorted(booked) != sorted(rows):
+        sys.exit("Planilha e reservas confirmadas divergem!")
+    _check_index(per_slot, "depois de reiniciar")
+
+    return attempts / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--attempts", type=int, default=400)
+    parser.add_argument("--slots", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.005, help="latência simulada por chamada ao Sheets (s)")
+    parser.add_argument("--write-behind", action="store_true", help="usa o diário local em vez de gravar a cada reserva")
+    parser.add_argument("--cache-ttl", type=float, default=0.02, help="intervalo entre releituras da planilha (s)")
+    parser.add_argument("--capacity", type=int, default=3, help="instrutores disputados em cada horário")
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        rate = run(workers, args.attempts, args.slots, args.latency, args.write_behind, args.cache_ttl, args.capacity)
+        print(f"{workers:>2} threads: {rate:10.1f} tentativas/s (capacidade respeitada)")
+
+
+if __name__ == "__main__":
+    main()